@@ -2,20 +2,22 @@ import sys
 from PyQt5.QtWidgets import QApplication
 from view import AppView
 from controller import AppController
-from model import AppModel
-import pandas as pd
+from model import AppModel, CompatibilityCatalog
+from result_cache import default_cache_path
 
 def create_complete_data(csv_path):
-    df = pd.read_csv(csv_path, sep=",")
-    return df.values, df.columns.to_list(), df
+    # Uses data/retention_pc.npy instead of the CSV when it is an up to date conversion
+    catalog = CompatibilityCatalog.load(csv_path)
+    return catalog, catalog.product_names, catalog
 
 def main():
     retention_csv = 'data/retention_pc.csv'
-    compat_matrix, products, df = create_complete_data(retention_csv)
+    compat_matrix, products, catalog = create_complete_data(retention_csv)
     app = QApplication(sys.argv)
     view = AppView(products=products)
     view.show()
-    model = AppModel(compat_matrix, products)
+    # Same result file as the command line on this catalog
+    model = AppModel(compat_matrix, products, cache_path=default_cache_path(retention_csv))
     AppController(view=view, model=model)
     sys.exit(app.exec_())
 
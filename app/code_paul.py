@@ -1,11 +1,18 @@
 from __future__ import print_function
+import os
+import sys
 from ortools.linear_solver import pywraplp
 import pandas as pd
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backends
+from catalog import CompatibilityCatalog
+from grouping import Grouping
+
 
 def create_complete_data(csv_path : str = 'data/retention_pc.csv'):
-    df = pd.read_csv(csv_path, sep=",")
-    return df.values, df.columns.to_list(), df
+    catalog = CompatibilityCatalog.load(csv_path)
+    return catalog, catalog.product_names, catalog
 
 def read_product_name(csv_path: str = 'data/product_names.csv'):
     df = pd.read_csv(csv_path, sep=",")
@@ -13,35 +20,11 @@ def read_product_name(csv_path: str = 'data/product_names.csv'):
 
 def create_data_model(full_matrix, full_product_name_list, list_name):
     """Stores the data for the problem."""
-    list_index = []
-    for name in list_name:
-        index = 0
-        found_product = False
-        for i, prod in enumerate(full_product_name_list):
-            if full_product_name_list[i] == name:
-                index = i
-                found_product = True
-        if not found_product:
-            print("Wrong product name - {0} - Problem might not be solvable \n".format(name))
-        else:
-            list_index.append(index)
-
-    # Creating the matrix used to solve the problem
-    matrix = []
-    for i in range(len(list_index)):
-        matrix.append([])
-        for j in range(len(list_index)):
-            matrix[i].append(full_matrix[list_index[i]][list_index[j]])
-
-    data = {
-        "comp_matrix": matrix,
-        "num_product": len(matrix),
-        'name_product': list_name
-    }
-    # Si aucun nom, on met juste des numéros de produits
-    if len(data['name_product']) == 0:
-        data['name_product'] = range(data['num_product'])
-    return data
+    if isinstance(full_matrix, CompatibilityCatalog):
+        catalog = full_matrix
+    else:
+        catalog = CompatibilityCatalog(full_matrix, full_product_name_list)
+    return catalog.create_data_model(list_name)
 
 def verify_data_model(data):
   """Verifies the shape of the input"""
@@ -64,20 +47,9 @@ def process_result(solver, status, data, comp_var, group):
   """Process the result"""
   if status == pywraplp.Solver.OPTIMAL:
 
-    min_index_group = 0
-    for i in range(data['num_product']):
-      if group[i].solution_value() == 1:
-        min_index_group = i
-        break
-
     print('\nNumber of groups = %d' % solver.Objective().Value())
-    pair_product_group_list = []
-    for i in range(data['num_product']):
-      for j in range(data['num_product']):
-          if comp_var[i][j].solution_value() == 1:
-            pair_product_group_list.append([i,j - min_index_group])
-
-    print_group(pair_product_group_list, data)
+    pair_product_group_list = backends.process_result(status, data, comp_var, group, solver)
+    print_group(Grouping.from_pairs(pair_product_group_list, data['num_product'], 'OPTIMAL'), data)
 
     print('\n------------Resolution information-------------\n')
     print('Problem solved in %f milliseconds' % solver.wall_time())
@@ -87,18 +59,14 @@ def process_result(solver, status, data, comp_var, group):
     print('The problem does not have an optimal solution.')
   return
 
-def print_group(pair_product_group_list, data):
+def print_group(grouping, data):
   """Print the group"""
 
   print('\n---------------------Groups--------------------')
-  pair_product_group_list = sorted(pair_product_group_list, key = lambda x: x[1])
-  group_index = -1
-  for pair_product_group in pair_product_group_list:
-    if group_index != pair_product_group[1]:
-      group_index = pair_product_group[1]
-      print("\nGroup {0} contains : {1}".format(group_index, data['name_product'][pair_product_group[0]]))
-    else:
-      print("{0}                  {1}".format(" "*len(str(group_index)),data['name_product'][pair_product_group[0]]))
+  for group_index, names in enumerate(grouping.names(data['name_product'])):
+    print("\nGroup {0} contains : {1}".format(group_index, names[0]))
+    for name in names[1:]:
+      print("{0}                  {1}".format(" "*len(str(group_index)),name))
 
 
 def main():
@@ -1,27 +1,86 @@
+import os
+import sys
+from PyQt5.QtCore import QThread, pyqtSignal
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backends import SolveHandle
+
+
+class SolveThread(QThread):
+    """Run one model.run call off the Qt event loop"""
+    progress = pyqtSignal(int, float, float)
+    done = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, model, list_name):
+        super().__init__()
+        self.model = model
+        self.list_name = list_name
+        self.handle = SolveHandle()
+
+    def run(self):
+        try:
+            result = self.model.run(self.list_name, progress=self.progress.emit, handle=self.handle)
+        except Exception as error:
+            self.failed.emit(str(error))
+        else:
+            self.done.emit(result)
+
+    def cancel(self):
+        self.handle.cancel()
+
+
 class AppController:
     def __init__(self, model, view):
         self._view = view
         self.model = model
+        self._current = None
+        self._threads = set()
         self._connect_signals()
 
     def _run_simu(self):
         widget = self._view.form.itemAt(1)
         combo = widget.widget()
         list_name = combo.currentData()
-        solver, pair_product_group_list, data, var_count = self.model.run(list_name)
-        group_index = -1
-        group_dict = {}
-        for pair_product_group in pair_product_group_list:
-            if group_index != pair_product_group[1]:
-                group_index = pair_product_group[1]
-                p = data["name_product"][pair_product_group[0]]
-                group_dict.setdefault(group_index, []).append(p)
-            else:
-                p = data["name_product"][pair_product_group[0]]
-                group_dict[group_index].append(p)
+        # A newer click supersedes the running solve
+        if self._current is not None:
+            self._current.cancel()
+        thread = SolveThread(self.model, list_name)
+        thread.progress.connect(lambda objective, bound, seconds: self._on_progress(thread, objective, bound))
+        thread.done.connect(lambda result: self._on_done(thread, result))
+        thread.failed.connect(lambda message: self._on_failed(thread, message))
+        thread.finished.connect(lambda: self._threads.discard(thread))
+        self._threads.add(thread)
+        self._current = thread
+        self._view.set_status('Calcul en cours...')
+        thread.start()
+
+    def _on_progress(self, thread, objective, bound):
+        if thread is self._current:
+            self._view.set_status(f'Meilleure solution : {objective} groupes (borne {bound:.0f})')
+
+    def _on_done(self, thread, result):
+        if thread is not self._current:
+            return
+        self._current = None
+        if result is None or result[1] is None:
+            self._view.set_status('Aucune solution')
+            return
+        solver, grouping, data, var_count = result
+        group_dict = dict(enumerate(grouping.names(data["name_product"])))
+        self._view.set_status('')
         self._view.set_display(group_dict)
 
+    def _on_failed(self, thread, message):
+        if thread is self._current:
+            self._current = None
+            self._view.set_status(f'Erreur : {message}')
+
     def _cancel_simu(self):
+        if self._current is not None:
+            self._current.cancel()
+            self._current = None
+        self._view.set_status('')
         self._view.clear_display()
 
     def _connect_signals(self):
@@ -1,45 +1,49 @@
 from __future__ import print_function
-from ortools.linear_solver import pywraplp
+import os
+import sys
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backends
+from backends import create_backend
+from catalog import CompatibilityCatalog
+from grouping import Grouping
+from metrics import SolveMetrics, emit
+from model_cache import ModelCache
+from session import IncrementalSession
+from result_cache import ResultCache
 
 class AppModel:
-	def __init__(self, full_matrix, full_product_name_list):
+	def __init__(self, full_matrix, full_product_name_list, builder='vectorized', use_presolve=True,
+	             backend='scip', num_search_workers=8, cache_path=None, cache_size=256, metrics_hook=None,
+	             use_reduction=True, model_cache_path=None, model_cache_size=0):
 		self.full_matrix = full_matrix
 		self.full_product_name_list = full_product_name_list
-		self.solver = pywraplp.Solver.CreateSolver('SCIP')
+		if isinstance(full_matrix, CompatibilityCatalog):
+			self.catalog = full_matrix
+		else:
+			self.catalog = CompatibilityCatalog(full_matrix, full_product_name_list)
+		self.solver = None
+		self.backend_name = backend
+		self.builder = builder
+		self.metrics_hook = metrics_hook
+		self.last_metrics = None
+		# Opt-in, sizes in megabytes as for ProductOptimizer
+		model_cache = None
+		if model_cache_size > 0 or model_cache_path is not None:
+			model_cache = ModelCache(model_cache_path, max_memory_bytes=model_cache_size * 2 ** 20)
+		self.backend = create_backend(backend, builder=builder, num_search_workers=num_search_workers,
+		                              model_cache=model_cache)
+		self.use_presolve = use_presolve
+		self.session = IncrementalSession(self.backend, use_presolve, use_reduction)
+		self.lock = threading.Lock()
+		self.cache = None
+		if cache_size > 0:
+			self.cache = ResultCache(self.catalog.fingerprint(), path=cache_path or None, max_entries=cache_size)
 
 	def create_data_model(self, list_name):
 		"""Stores the data for the problem."""
-		full_matrix = self.full_matrix
-		full_product_name_list = self.full_product_name_list
-		list_index = []
-		for name in list_name:
-			index = 0
-			found_product = False
-			for i, prod in enumerate(full_product_name_list):
-				if full_product_name_list[i] == name:
-					index = i
-					found_product = True
-			if not found_product:
-				print("Wrong product name - {0} - Problem might not be solvable \n".format(name))
-			else:
-				list_index.append(index)
-
-		# Creating the matrix used to solve the problem
-		matrix = []
-		for i in range(len(list_index)):
-			matrix.append([])
-			for j in range(len(list_index)):
-				matrix[i].append(full_matrix[list_index[i]][list_index[j]])
-
-		data = {
-			"comp_matrix": matrix,
-			"num_product": len(matrix),
-			'name_product': list_name
-		}
-		# Si aucun nom, on met juste des numéros de produits
-		if len(data['name_product']) == 0:
-			data['name_product'] = range(data['num_product'])
-		return data
+		return self.catalog.create_data_model(list_name, with_cliques=self.builder == 'clique')
 
 	def verify_data_model(self, data):
 		"""Verifies the shape of the input"""
@@ -61,74 +65,51 @@ class AppModel:
 
 		return right_input
 
-	def process_result(self, status, data, comp_var, group):
+	def process_result(self, status, data, comp_var, group, solver=None):
 		"""Process the result"""
-		pair_product_group_list = None
-		if status == pywraplp.Solver.OPTIMAL:
-			min_index_group = 0
-			for i in range(data['num_product']):
-				if group[i].solution_value() == 1:
-					min_index_group = i
-					break
-			pair_product_group_list = []
-			for i in range(data['num_product']):
-				for j in range(data['num_product']):
-					if comp_var[i][j].solution_value() == 1:
-						pair_product_group_list.append([i, j - min_index_group])
-		return pair_product_group_list
-
-	def run(self, list_name):
-		self.solver = pywraplp.Solver.CreateSolver('SCIP')
-		data = self.create_data_model(list_name)
+		return backends.process_result(status, data, comp_var, group, solver)
+
+	def run(self, list_name, time_limit=None, relative_gap=None, progress=None, handle=None, metrics=None):
+		# Runs may come from several GUI threads, a superseded one is interrupted and finishes first
+		metrics = metrics if metrics is not None else SolveMetrics(self.backend_name)
+		with self.lock:
+			self.last_metrics = metrics
+			result = self._run(list_name, time_limit, relative_gap, progress, handle, metrics)
+		emit(metrics, self.metrics_hook)
+		return result
+
+	def reset(self):
+		"""Give the solver of the last run back to the backend pool"""
+		if self.solver is not None:
+			self.backend.release(self.solver)
+			self.solver = None
+
+	def _run(self, list_name, time_limit, relative_gap, progress, handle, metrics):
+		self.reset()
+		with metrics.phase('load'):
+			data = self.create_data_model(list_name)
 		if not  self.verify_data_model(data):
 			return
-
-		# Creating group variables
-		group = {}
-		for i in range(data['num_product']):
-			group[i] = self.solver.IntVar(0, 1, 'group[%d]' % i)
-		num_group = self.solver.NumVariables()
-
-		# Creating compatibility variables
-		comp_var = []
-		for i in range(data['num_product']):
-			comp_var.append([])
-			for j in range(data['num_product']):
-				comp_var[i].append(self.solver.IntVar(0, 1, "comp_var[{0}][{1}]".format(i, j)))
-		num_compat_var = self.solver.NumVariables() - data['num_product']
-
-		# Contraintes de choix de groupe
-		for i in range(data['num_product']):
-			constraint_expr = \
-				[data['comp_matrix'][i][j] * comp_var[i][j] for j in range(data['num_product'])]
-			self.solver.Add(sum(constraint_expr) == 1)
-
-		# Contraintes d'incompatibilite
-		for i in range(data['num_product']):
-			for j in range(data['num_product']):
-				for k in range(data['num_product']):
-					if (data['comp_matrix'][i][k] == 1 and data['comp_matrix'][j][k] == 1 and data['comp_matrix'][i][
-						j] == 0):
-						self.solver.Add(comp_var[i][k] + comp_var[j][k] <= 1)
-
-		# Contraintes pour la création d'un groupe
-		for i in range(data['num_product']):
-			constraint_expr = [data['comp_matrix'][j][i] * comp_var[j][i] for j in range(data['num_product'])]
-			self.solver.Add(sum(constraint_expr) <= data['num_product'] * group[i])
-
-		num_constraints = self.solver.NumConstraints()
-
-		objective = self.solver.Objective()
-		for j in range(data['num_product']):
-			objective.SetCoefficient(group[j], 1)
-		objective.SetMinimization()
-
-		var_count = {
-			'num_group': num_group,
-			'num_compat_var': num_compat_var,
-			'num_constraints': num_constraints
-		}
-		status = self.solver.Solve()
-		pair_product_group_list = self.process_result(status, data, comp_var, group)
-		pair_product_group_list = sorted(pair_product_group_list, key=lambda x: x[1])
-		return self.solver, pair_product_group_list, data, var_count
+		metrics.num_product = data['num_product']
+
+		if self.cache is not None:
+			with metrics.phase('lookup'):
+				cached = self.cache.get(data['name_product'])
+			if cached is not None:
+				pair_product_group_list, var_count = cached
+				self.session.remember(data, pair_product_group_list)
+				metrics.cache_hit = True
+				metrics.record_solution(var_count)
+				grouping = Grouping.from_pairs(pair_product_group_list, data['num_product'], var_count['status'])
+				return None, grouping, data, var_count
+
+		# Warm-started from the previous run's grouping
+		self.solver, pair_product_group_list, var_count = self.session.run(data, time_limit, relative_gap, progress, handle,
+		                                                                   metrics)
+		if self.cache is not None and pair_product_group_list is not None and var_count['status'] == 'OPTIMAL':
+			self.cache.put(data['name_product'], pair_product_group_list, var_count)
+		metrics.record_solution(var_count)
+		grouping = None
+		if pair_product_group_list is not None:
+			grouping = Grouping.from_pairs(pair_product_group_list, data['num_product'], var_count['status'])
+		return self.solver, grouping, data, var_count
@@ -45,6 +45,9 @@ class AppView(QMainWindow):
         # self.table.setColumnCount(2)
         # self.table.setItem(0, 0, QTableWidgetItem("Groupe"))
         # self.table.setItem(0, 1, QTableWidgetItem("Produit"))
+        self.status = QLabel()
+        self.status.setAlignment(Qt.AlignCenter)
+        self.generalLayout.addWidget(self.status)
         self.display = QLabel()
         self.display.setAlignment(Qt.AlignCenter)
         self.display.setFixedSize(400, 400)
@@ -73,10 +76,11 @@ class AppView(QMainWindow):
         # 		i += 1
 
 
+    def set_status(self, text):
+        self.status.setText(text)
+
     def clear_display(self):
         widget = self.form.itemAt(1)
         combo = widget.widget()
         combo.clear()
-
-        for i in range(1, self.table.rowCount() + 1):
-            self.table.removeRow(1)
\ No newline at end of file
+        self.display.setText("")
\ No newline at end of file
@@ -0,0 +1,438 @@
+from ortools.linear_solver import linear_solver_pb2, pywraplp
+from ortools.sat.python import cp_model
+import math
+import numpy as np
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from metrics import SolveMetrics
+from model_cache import ModelCache, canonical_data, model_key
+from model_builder import MODEL_BUILDERS, add_group_bounds, comp_var_keys, iter_comp_var, separate_incompatibilities
+from presolve import (accepts_own_groups, coloring_to_pairs, dsatur_coloring, incompatibility_graph, repair_coloring,
+                      representative_assignment, solution_info)
+from solver_pool import SolverPool
+
+STATUS_NAMES = {
+	pywraplp.Solver.OPTIMAL: 'OPTIMAL',
+	pywraplp.Solver.FEASIBLE: 'FEASIBLE'
+}
+
+
+def solution_values(solver: pywraplp.Solver) -> np.ndarray:
+	"""
+	Read the value of every variable of the last solve in a single call
+	:param solver: Solved solver
+	:return: Values indexed like the variables, in creation order
+	"""
+	response = linear_solver_pb2.MPSolutionResponse()
+	solver.FillSolutionResponseProto(response)
+	return np.asarray(response.variable_value)
+
+
+def process_result(status, data, comp_var, group, solver: Optional[pywraplp.Solver] = None) -> List:
+	"""
+	Resolve optimization problem
+	:param status: Solver Status
+	:param data: Data matrix
+	:param comp_var: Matrice X
+	:param group: Matrice Y
+	:param solver: Solver holding the model, its values are then read in bulk instead of one variable at a time
+	:return: Liste des groupes avec les produits associés
+	"""
+	pair_product_group_list = None
+	# A time-limited solve keeps its best incumbent, whose values may carry a small tolerance
+	if status in (pywraplp.Solver.OPTIMAL, pywraplp.Solver.FEASIBLE):
+		num_group = len(group)
+		keys = comp_var_keys(comp_var)
+		values = solution_values(solver) if solver is not None else None
+		# Builders create the group variables first, then comp_var in iteration order
+		if values is not None and len(values) == num_group + len(keys):
+			opened = values[:num_group] > 0.5
+			chosen = values[num_group:] > 0.5
+		else:
+			opened = np.array([group[k].solution_value() > 0.5 for k in range(num_group)], dtype=bool)
+			chosen = np.array([var.solution_value() > 0.5 for _, _, var in iter_comp_var(comp_var)], dtype=bool)
+		min_index_group = int(np.argmax(opened)) if opened.any() else 0
+		products, groups = keys[chosen].T
+		pair_product_group_list = np.column_stack((products, groups - min_index_group)).tolist()
+	return pair_product_group_list
+
+
+def set_grouping_hint(solver: pywraplp.Solver, group: Dict, comp_var, coloring: List[int]) -> None:
+	"""
+	Give a grouping as starting solution, each group being represented by its smallest product
+	:param solver: Solver holding the model
+	:param group: Group variables (Y)
+	:param comp_var: Compatibility variables (X)
+	:param coloring: Group id of each product
+	"""
+	assignment = representative_assignment(coloring)
+	variables = [var for _, _, var in iter_comp_var(comp_var)]
+	values = [float(assignment[i] == k) for i, k, _ in iter_comp_var(comp_var)]
+	opened = set(assignment)
+	variables.extend(group[k] for k in range(len(group)))
+	values.extend(float(k in opened) for k in range(len(group)))
+	solver.SetHint(variables, values)
+
+
+def solve_lazy(solver: pywraplp.Solver, data: Dict, group: Dict, comp_var: Dict,
+               parameters: pywraplp.MPSolverParameters, hint: Optional[List[int]] = None, lower_bound: int = 1,
+               deadline: Optional[float] = None, handle=None,
+               metrics: Optional[SolveMetrics] = None) -> Tuple[Optional[List], Optional[Dict], int]:
+	"""
+	Solve a model built by build_lazy_model by rounds: the incompatibilities violated by the incumbent are added
+	as cuts, and the incumbent repaired into a feasible grouping hints the next round. Every round solves a relaxation,
+	so its bound holds for the full model and a repaired grouping reaching it is optimal.
+	:param solver: Solver holding the lazy model, bounds already added
+	:param data: Data matrix
+	:param group: Group variables (Y)
+	:param comp_var: Compatibility variables keyed by (product, group)
+	:param parameters: Parameters of every round
+	:param hint: Feasible grouping (group id per product), defaults to a DSATUR coloring
+	:param lower_bound: Number of groups proven needed beforehand
+	:param deadline: time.perf_counter() value after which the best feasible grouping is returned
+	:param handle: SolveHandle whose cancellation stops the rounds without result
+	:param metrics: Receives the solve, cut separation (build) and extraction times
+	:return: pair_product_group_list (None when none was found), its solution_info and the number of cuts added
+	"""
+	metrics = metrics if metrics is not None else SolveMetrics()
+	num_product = data['num_product']
+	adjacency = None
+	if accepts_own_groups(data['comp_matrix']):
+		adjacency = incompatibility_graph(data['comp_matrix'])
+		if hint is None:
+			hint = dsatur_coloring(adjacency)
+	best = hint
+	best_bound = lower_bound
+	num_cuts = 0
+	while True:
+		if deadline is not None:
+			solver.SetTimeLimit(max(1, int((deadline - time.perf_counter()) * 1000)))
+		if best is not None:
+			set_grouping_hint(solver, group, comp_var, best)
+		with metrics.phase('solve'):
+			status = solver.Solve(parameters)
+		metrics.add_search(solver.nodes(), solver.iterations())
+		if handle is not None and handle.cancelled:
+			return None, None, num_cuts
+		if status not in STATUS_NAMES:
+			break
+		objective = solver.Objective()
+		objective_value, objective_bound = round(objective.Value()), objective.BestBound()
+		best_bound = max(best_bound, math.ceil(objective_bound - 1e-6))
+		# Read once before any cut is added, the solver drops its solution when the model changes
+		with metrics.phase('extraction'):
+			pair_product_group_list = process_result(status, data, comp_var, group, solver)
+		with metrics.phase('build'):
+			new_cuts = separate_incompatibilities(solver, data, comp_var, pair_product_group_list)
+		num_cuts += new_cuts
+		if new_cuts == 0:
+			if best is None or objective_value <= len(set(best)):
+				return pair_product_group_list, solution_info(STATUS_NAMES[status], objective_value,
+				                                              objective_bound), num_cuts
+			break
+		if adjacency is not None:
+			with metrics.phase('extraction'):
+				coloring = [0] * num_product
+				for i, label in pair_product_group_list:
+					coloring[i] = label
+				repaired = repair_coloring(adjacency, coloring)
+			if best is None or len(set(repaired)) < len(set(best)):
+				best = repaired
+		if best is not None and len(set(best)) <= best_bound:
+			break
+		if deadline is not None and time.perf_counter() >= deadline:
+			break
+	if best is None:
+		return None, None, num_cuts
+	num_groups = len(set(best))
+	status = 'OPTIMAL' if num_groups <= best_bound else 'FEASIBLE'
+	return coloring_to_pairs(best), solution_info(status, num_groups, min(best_bound, num_groups)), num_cuts
+
+
+class SolveHandle:
+	"""
+	Lets another thread interrupt the solve it is passed to
+	"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.interrupt = None
+		self.cancelled = False
+
+	def attach(self, interrupt: Callable) -> bool:
+		"""
+		Register the running solver
+		:param interrupt: Stops the solver, e.g. Solver.InterruptSolve
+		:return: False when the handle was cancelled before the solve started
+		"""
+		with self.lock:
+			self.interrupt = interrupt
+			return not self.cancelled
+
+	def detach(self) -> None:
+		"""Forget the solver once its solve returned"""
+		with self.lock:
+			self.interrupt = None
+
+	def cancel(self) -> None:
+		"""Interrupt the running solve, or prevent the next one from starting"""
+		with self.lock:
+			self.cancelled = True
+			if self.interrupt is not None:
+				self.interrupt()
+
+
+class ScipBackend:
+	"""
+	Assignment MIP solved by SCIP through pywraplp
+	"""
+	name = 'scip'
+
+	def __init__(self, builder: str = 'vectorized', pool_size: int = 2, model_cache: Optional[ModelCache] = None):
+		"""
+		:param builder: Model construction engine, one of MODEL_BUILDERS, 'lazy' solving by rounds of cuts
+		:param pool_size: Number of idle SCIP solvers kept for the next solves
+		:param model_cache: Models built for earlier selections, loaded instead of being built again
+		"""
+		self.builder = builder
+		self.build_model = MODEL_BUILDERS[builder]
+		self.lazy = builder == 'lazy'
+		self.pool = SolverPool('SCIP', pool_size)
+		self.model_cache = model_cache
+
+	def release(self, solver: pywraplp.Solver) -> None:
+		"""
+		Give a solver returned by solve back to the pool once its solution has been read
+		:param solver: Solver of a previous solve
+		"""
+		self.pool.release(solver)
+
+	def solve(self, data: Dict, bounds: Optional[Dict] = None, hint: Optional[List[int]] = None,
+	          time_limit: Optional[float] = None, relative_gap: Optional[float] = None,
+	          progress: Optional[Callable] = None, handle: Optional[SolveHandle] = None,
+	          metrics: Optional[SolveMetrics] = None) -> Tuple:
+		"""
+		Build the model, or load it from the model cache, on an empty solver borrowed from the pool (see release)
+		and solve it
+		:param data: Data matrix
+		:param bounds: Presolve result whose bounds restrict the number of groups
+		:param hint: Feasible grouping (group id per product) used as starting solution, defaults to the presolve coloring
+		:param time_limit: Seconds after which the best incumbent is returned
+		:param relative_gap: Relative gap at which the search stops
+		:param progress: Called with (objective, best_bound, seconds), pywraplp only reports the final incumbent
+		:param handle: Used by another thread to interrupt the solve
+		:param metrics: Receives the build, solve and extraction times and the search statistics
+		:return: Solver, pair_product_group_list and var_count (with status, objective, best_bound and gap)
+		"""
+		if self.model_cache is None:
+			return self._solve(data, bounds, hint, time_limit, relative_gap, progress, handle, metrics)
+		# Cached models are built on the products sorted by name, whatever order they were requested in
+		canonical, order = canonical_data(data)
+		if canonical is data:
+			return self._solve(data, bounds, hint, time_limit, relative_gap, progress, handle, metrics)
+		if hint is not None:
+			hint = [hint[i] for i in order]
+		if bounds is not None and bounds['coloring'] is not None:
+			bounds = dict(bounds, coloring=[bounds['coloring'][i] for i in order])
+		solver, pair_product_group_list, var_count = self._solve(canonical, bounds, hint, time_limit, relative_gap,
+		                                                         progress, handle, metrics)
+		if pair_product_group_list is not None:
+			pair_product_group_list = [[order[p], group] for p, group in pair_product_group_list]
+		return solver, pair_product_group_list, var_count
+
+	def _solve(self, data: Dict, bounds: Optional[Dict], hint: Optional[List[int]], time_limit: Optional[float],
+	           relative_gap: Optional[float], progress: Optional[Callable], handle: Optional[SolveHandle],
+	           metrics: Optional[SolveMetrics]) -> Tuple:
+		metrics = metrics if metrics is not None else SolveMetrics()
+		with metrics.phase('build'):
+			solver = self.pool.acquire()
+			loaded = None
+			if self.model_cache is not None:
+				key = model_key(self.builder, data)
+				loaded = self.model_cache.load(key, solver)
+			if loaded is not None:
+				group, comp_var, var_count = loaded
+				metrics.model_cache_hit = True
+			else:
+				group, comp_var, var_count = self.build_model(solver, data)
+				if self.model_cache is not None:
+					self.model_cache.store(key, solver, comp_var_keys(comp_var), var_count)
+			if bounds is not None:
+				add_group_bounds(solver, group, bounds['lower_bound'], bounds['upper_bound'])
+				if hint is None:
+					hint = bounds['coloring']
+			if hint is not None and not self.lazy:
+				set_grouping_hint(solver, group, comp_var, hint)
+		deadline = time.perf_counter() + time_limit if time_limit is not None else None
+		parameters = pywraplp.MPSolverParameters()
+		if relative_gap is not None:
+			parameters.SetDoubleParam(pywraplp.MPSolverParameters.RELATIVE_MIP_GAP, relative_gap)
+		if handle is not None and not handle.attach(solver.InterruptSolve):
+			return solver, None, var_count
+		if self.lazy:
+			lower_bound = bounds['lower_bound'] if bounds is not None else 1
+			pair_product_group_list, info, num_cuts = solve_lazy(solver, data, group, comp_var, parameters, hint,
+			                                                     lower_bound, deadline, handle, metrics)
+			var_count['num_constraints'] += num_cuts
+			if info is not None:
+				var_count.update(info)
+		else:
+			if deadline is not None:
+				solver.SetTimeLimit(max(1, int((deadline - time.perf_counter()) * 1000)))
+			with metrics.phase('solve'):
+				status = solver.Solve(parameters)
+			metrics.add_search(solver.nodes(), solver.iterations())
+			with metrics.phase('extraction'):
+				pair_product_group_list = process_result(status, data, comp_var, group, solver)
+			if pair_product_group_list is not None:
+				objective = solver.Objective()
+				var_count.update(solution_info(STATUS_NAMES[status], round(objective.Value()), objective.BestBound()))
+		if handle is not None:
+			handle.detach()
+		if pair_product_group_list is not None and progress is not None:
+			progress(var_count['objective'], var_count['best_bound'], solver.wall_time() / 1000)
+		return solver, pair_product_group_list, var_count
+
+
+class CpSatBackend:
+	"""
+	Same grouping model written for CP-SAT, searched by several workers in parallel
+	"""
+	name = 'cp-sat'
+
+	def __init__(self, num_search_workers: int = 8):
+		"""
+		:param num_search_workers: Number of parallel CP-SAT workers
+		"""
+		self.num_search_workers = num_search_workers
+
+	def release(self, solver) -> None:
+		"""CP-SAT solvers hold no model, there is nothing to give back"""
+
+	def solve(self, data: Dict, bounds: Optional[Dict] = None, hint: Optional[List[int]] = None,
+	          time_limit: Optional[float] = None, relative_gap: Optional[float] = None,
+	          progress: Optional[Callable] = None, handle: Optional[SolveHandle] = None,
+	          metrics: Optional[SolveMetrics] = None) -> Tuple:
+		"""
+		Build and solve the model with CP-SAT
+		:param data: Data matrix
+		:param bounds: Presolve result whose bounds restrict the number of groups
+		:param hint: Feasible grouping (group id per product) used as starting solution, defaults to the presolve coloring
+		:param time_limit: Seconds after which the best incumbent is returned
+		:param relative_gap: Relative gap at which the search stops
+		:param progress: Called with (objective, best_bound, seconds) on every improving solution
+		:param handle: Used by another thread to interrupt the solve
+		:param metrics: Receives the build, solve and extraction times and the search statistics
+		:return: CpSolver, pair_product_group_list and var_count (with status, objective, best_bound and gap)
+		"""
+		metrics = metrics if metrics is not None else SolveMetrics()
+		with metrics.phase('build'):
+			num_product = data['num_product']
+			allowed = np.asarray(data['comp_matrix']).reshape(num_product, num_product) == 1
+			model = cp_model.CpModel()
+
+			group = [model.NewBoolVar('group[%d]' % k) for k in range(num_product)]
+			comp_var = {}
+			for i, k in np.argwhere(allowed).tolist():
+				comp_var[i, k] = model.NewBoolVar("comp_var[{0}][{1}]".format(i, k))
+
+			# Contraintes de choix de groupe
+			for i in range(num_product):
+				model.AddExactlyOne(comp_var[i, k] for k in np.flatnonzero(allowed[i]).tolist())
+
+			# Contraintes d'incompatibilite : not (X[i][k] and X[j][k])
+			incompatible = ~(allowed & allowed.T)
+			for i, j in np.argwhere(np.triu(incompatible, 1)).tolist():
+				for k in np.flatnonzero(allowed[i] & allowed[j]).tolist():
+					model.AddBoolOr([comp_var[i, k].Not(), comp_var[j, k].Not()])
+
+			# Contraintes pour la création d'un groupe : X[i][k] => Y[k]
+			for (i, k), var in comp_var.items():
+				model.AddBoolOr([var.Not(), group[k]])
+
+			if bounds is not None:
+				model.AddLinearConstraint(sum(group), bounds['lower_bound'], bounds['upper_bound'])
+				if hint is None:
+					hint = bounds['coloring']
+			if hint is not None:
+				assignment = representative_assignment(hint)
+				for (i, k), var in comp_var.items():
+					model.AddHint(var, int(assignment[i] == k))
+				opened = set(assignment)
+				for k in range(num_product):
+					model.AddHint(group[k], int(k in opened))
+			model.Minimize(sum(group))
+
+			var_count = {
+				'num_group': num_product,
+				'num_compat_var': len(comp_var),
+				'num_constraints': len(model.Proto().constraints)
+			}
+
+		solver = cp_model.CpSolver()
+		solver.parameters.num_search_workers = self.num_search_workers
+		if time_limit is not None:
+			solver.parameters.max_time_in_seconds = time_limit
+		if relative_gap is not None:
+			solver.parameters.relative_gap_limit = relative_gap
+		callback = _ProgressCallback(progress) if progress is not None else None
+		if handle is not None and not handle.attach(solver.StopSearch):
+			return solver, None, var_count
+		with metrics.phase('solve'):
+			status = solver.Solve(model, callback)
+		if handle is not None:
+			handle.detach()
+		metrics.add_search(solver.NumBranches(), solver.NumConflicts())
+
+		pair_product_group_list = None
+		if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+			with metrics.phase('extraction'):
+				# Group variables come first, then comp_var in insertion order
+				values = np.asarray(solver.ResponseProto().solution)
+				opened = values[:num_product] > 0
+				chosen = values[num_product:num_product + len(comp_var)] > 0
+				min_index_group = int(np.argmax(opened)) if opened.any() else 0
+				products, groups = comp_var_keys(comp_var)[chosen].T
+				pair_product_group_list = np.column_stack((products, groups - min_index_group)).tolist()
+			var_count.update(solution_info('OPTIMAL' if status == cp_model.OPTIMAL else 'FEASIBLE',
+			                               round(solver.ObjectiveValue()), solver.BestObjectiveBound()))
+		return solver, pair_product_group_list, var_count
+
+
+class _ProgressCallback(cp_model.CpSolverSolutionCallback):
+	"""
+	Forward every improving CP-SAT solution to a progress callback
+	"""
+	def __init__(self, progress: Callable):
+		super().__init__()
+		self.progress = progress
+
+	def on_solution_callback(self):
+		self.progress(round(self.ObjectiveValue()), self.BestObjectiveBound(), self.WallTime())
+
+
+BACKENDS = ('scip', 'cp-sat', 'colgen', 'portfolio')
+
+
+def create_backend(name: str, builder: str = 'vectorized', num_search_workers: int = 8,
+                   model_cache: Optional[ModelCache] = None):
+	"""
+	Instantiate a solving backend
+	:param name: One of BACKENDS
+	:param builder: Model construction engine used by the SCIP backend
+	:param num_search_workers: Number of workers used by the CP-SAT backend
+	:param model_cache: Models kept by the SCIP backend across solves
+	:return: Backend exposing solve(data, bounds)
+	"""
+	if name == 'scip':
+		return ScipBackend(builder, model_cache=model_cache)
+	if name == 'cp-sat':
+		return CpSatBackend(num_search_workers)
+	if name == 'colgen':
+		# Imported here since column_generation itself falls back on ScipBackend
+		from column_generation import ColumnGenerationBackend
+		return ColumnGenerationBackend()
+	if name == 'portfolio':
+		from portfolio import PortfolioBackend
+		return PortfolioBackend(builder, num_search_workers)
+	raise ValueError("Unknown backend - {0} - expected one of {1}".format(name, ", ".join(BACKENDS)))
@@ -0,0 +1,207 @@
+import contextlib
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import sys
+import time
+from typing import Dict, Iterator, Optional, TextIO
+from catalog import UnknownProductsError
+from optimizer import ProductOptimizer
+
+
+def read_jobs(stream: TextIO) -> Iterator[Dict]:
+	"""
+	Read product lists, one per line: a JSON list, a JSON object with "products" (and optionally "id",
+	"time_limit" and "relative_gap"), or comma separated product names
+	:param stream: Opened JSONL/CSV file or stdin
+	:return: Generator of jobs {"id", "products"}, a line that cannot be read giving {"id", "error"} instead
+	"""
+	for line_number, line in enumerate(stream, start=1):
+		line = line.strip()
+		if not line:
+			continue
+		if line[0] in '[{':
+			try:
+				job = json.loads(line)
+			except ValueError as error:
+				yield {'id': line_number, 'error': 'invalid JSON: {0}'.format(error)}
+				continue
+			if isinstance(job, list):
+				job = {'products': job}
+			if not isinstance(job, dict) or not isinstance(job.get('products'), list):
+				yield {'id': line_number, 'error': 'invalid job: expected a list of products or {"products": [...]}'}
+				continue
+		else:
+			job = {'products': [name.strip() for name in line.split(',') if name.strip()]}
+		job.setdefault('id', line_number)
+		yield job
+
+
+def _worker(worker_index: int, optimizer_kwargs: Dict, solve_kwargs: Dict, connection) -> None:
+	"""
+	Load the catalog once, then solve the jobs received on the connection until a None sentinel
+	"""
+	if hasattr(os, 'setpgrp'):
+		# Own process group, so that run_batch also stops the processes a backend starts (e.g. portfolio races)
+		os.setpgrp()
+	# Stdout carries the JSON lines of run_batch, the optimizer's messages go to stderr
+	with contextlib.redirect_stdout(sys.stderr):
+		optimizer = ProductOptimizer(**optimizer_kwargs)
+		while True:
+			try:
+				job = connection.recv()
+			except EOFError:
+				return
+			if job is None:
+				return
+			start = time.perf_counter()
+			try:
+				_, grouping, data, var_count = optimizer.run_simulation(
+					job['products'], job.get('time_limit', solve_kwargs.get('time_limit')),
+					job.get('relative_gap', solve_kwargs.get('relative_gap')))
+				if grouping is None:
+					result = {'id': job['id'], 'status': 'error', 'error': 'no grouping found'}
+				else:
+					result = {
+						'id': job['id'],
+						'status': 'ok',
+						'groups': grouping.names(data['name_product']),
+						'var_count': var_count
+					}
+			except UnknownProductsError as error:
+				result = {'id': job['id'], 'status': 'error', 'error': str(error)}
+			except Exception as error:
+				result = {'id': job['id'], 'status': 'error', 'error': '{0}: {1}'.format(type(error).__name__, error)}
+			result['time'] = time.perf_counter() - start
+			connection.send(result)
+
+
+def run_batch(stream: TextIO, output: TextIO, optimizer_kwargs: Dict, workers: Optional[int] = None,
+              timeout: Optional[float] = None, time_limit: Optional[float] = None,
+              relative_gap: Optional[float] = None) -> None:
+	"""
+	Solve every product list of a stream on a pool of worker processes, writing one JSON line per job
+	as soon as it finishes. A job exceeding the timeout or crashing its worker is reported as an error
+	and the worker is replaced, the other jobs are not affected.
+	:param stream: Input read by read_jobs
+	:param output: Where JSON results are written
+	:param optimizer_kwargs: Arguments of ProductOptimizer, each worker loads its own instance once
+	:param workers: Number of worker processes, defaults to the number of CPUs
+	:param timeout: Wall time allowed per job in seconds, None for no limit
+	:param time_limit: Default solver time limit of the jobs, the best incumbent is returned when reached
+	:param relative_gap: Default relative gap of the jobs
+	"""
+	workers = workers or multiprocessing.cpu_count()
+	solve_kwargs = {'time_limit': time_limit, 'relative_gap': relative_gap}
+	# Each worker has its own pipe and is only sent a job when idle, so that killing it can only lose
+	# the job it is running
+	processes = {}
+	connections = {}
+	running = {}
+	idle = []
+
+	def spawn(worker_index):
+		parent_end, child_end = multiprocessing.Pipe()
+		# Not a daemon, so that the portfolio backend may start its own processes; stopped below instead
+		process = multiprocessing.Process(target=_worker, args=(worker_index, optimizer_kwargs, solve_kwargs, child_end))
+		process.start()
+		child_end.close()
+		processes[worker_index] = process
+		connections[worker_index] = parent_end
+		idle.append(worker_index)
+
+	def stop(worker_index):
+		process = processes[worker_index]
+		# Daemonic children of a terminated worker are not cleaned up by multiprocessing, its whole group is
+		try:
+			if hasattr(os, 'killpg'):
+				os.killpg(process.pid, signal.SIGTERM)
+			else:
+				process.terminate()
+		except ProcessLookupError:
+			pass
+		process.join()
+		connections[worker_index].close()
+
+	def emit(result):
+		output.write(json.dumps(result) + '\n')
+		output.flush()
+
+	def receive(worker_index):
+		# A result sent before the worker was noticed as timed out or dead still counts
+		try:
+			result = connections[worker_index].recv()
+		except (EOFError, OSError):
+			return False
+		del running[worker_index]
+		idle.append(worker_index)
+		emit(result)
+		return True
+
+	for worker_index in range(workers):
+		spawn(worker_index)
+
+	try:
+		jobs = read_jobs(stream)
+		exhausted = False
+		while True:
+			while idle and not exhausted:
+				job = next(jobs, None)
+				if job is None:
+					exhausted = True
+				elif 'error' in job:
+					emit({'id': job['id'], 'status': 'error', 'error': job['error'], 'time': 0.0})
+				else:
+					worker_index = idle.pop()
+					connections[worker_index].send(job)
+					running[worker_index] = (job['id'], time.perf_counter())
+			if exhausted and not running:
+				break
+
+			by_connection = {connections[worker_index]: worker_index for worker_index in processes}
+			for connection in multiprocessing.connection.wait(list(by_connection), timeout=0.1):
+				worker_index = by_connection[connection]
+				if worker_index in running:
+					receive(worker_index)
+				else:
+					# Idle workers only stop on the final sentinel, this one could not load the catalog
+					processes[worker_index].join()
+					raise RuntimeError("Batch worker {0} exited with code {1}".format(
+						worker_index, processes[worker_index].exitcode))
+
+			now = time.perf_counter()
+			for worker_index, (job_id, started) in list(running.items()):
+				process = processes[worker_index]
+				if timeout is not None and now - started > timeout:
+					error = 'timeout after {0} s'.format(timeout)
+				elif not process.is_alive():
+					error = 'worker exited with code {0}'.format(process.exitcode)
+				else:
+					continue
+				if connections[worker_index].poll() and receive(worker_index):
+					continue
+				stop(worker_index)
+				del running[worker_index]
+				emit({'id': job_id, 'status': 'error', 'error': error, 'time': now - started})
+				spawn(worker_index)
+	except BaseException:
+		for worker_index in processes:
+			stop(worker_index)
+		raise
+
+	for worker_index in processes:
+		connections[worker_index].send(None)
+	for worker_index in processes:
+		processes[worker_index].join()
+
+
+def open_jobs(path: str) -> TextIO:
+	"""
+	:param path: Path of the job file, '-' for stdin
+	:return: Opened stream
+	"""
+	if path == '-':
+		return sys.stdin
+	return open(path)
@@ -0,0 +1,195 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import numpy as np
+from typing import Dict, Iterator, List, Optional, TextIO
+from backends import BACKENDS
+from catalog import CompatibilityCatalog
+from metrics import SolveMetrics
+from model_builder import MODEL_BUILDERS
+from optimizer import ProductOptimizer
+
+STRUCTURES = ('random', 'block')
+
+
+def random_matrix(num_product: int, density: float, seed: int) -> np.ndarray:
+	"""
+	Uniform random retention matrix
+	:param num_product: Number of products
+	:param density: Probability that a product retains another one
+	:param seed: Random seed, the same seed gives the same matrix
+	:return: 0/1 matrix with a diagonal of 1
+	"""
+	rng = np.random.default_rng(seed)
+	matrix = (rng.random((num_product, num_product)) < density).astype(np.int8)
+	np.fill_diagonal(matrix, 1)
+	return matrix
+
+
+def block_matrix(num_product: int, density: float, seed: int, blocks: int = 4, density_out: float = 0.05) -> np.ndarray:
+	"""
+	Retention matrix made of families of products, mostly compatible within a family
+	:param num_product: Number of products
+	:param density: Probability of compatibility inside a family
+	:param seed: Random seed, the same seed gives the same matrix
+	:param blocks: Number of families
+	:param density_out: Probability of compatibility between two families
+	:return: 0/1 matrix with a diagonal of 1
+	"""
+	rng = np.random.default_rng(seed)
+	family = rng.integers(blocks, size=num_product)
+	same = family[:, None] == family[None, :]
+	matrix = (rng.random((num_product, num_product)) < np.where(same, density, density_out)).astype(np.int8)
+	np.fill_diagonal(matrix, 1)
+	return matrix
+
+
+def make_catalog(structure: str, num_product: int, density: float, seed: int, blocks: int) -> CompatibilityCatalog:
+	"""
+	:return: Synthetic catalog whose products are named P0, P1, ...
+	"""
+	if structure == 'random':
+		matrix = random_matrix(num_product, density, seed)
+	elif structure == 'block':
+		matrix = block_matrix(num_product, density, seed, blocks)
+	else:
+		raise ValueError("Unknown structure - {0} - expected one of {1}".format(structure, ", ".join(STRUCTURES)))
+	return CompatibilityCatalog(matrix, ['P{0}'.format(i) for i in range(num_product)])
+
+
+def run_case(optimizer: ProductOptimizer, time_limit: Optional[float]) -> Dict:
+	"""
+	Solve the whole catalog once through run_simulation, as the CLI does
+	:param optimizer: Optimizer loaded on the synthetic catalog, without result cache
+	:param time_limit: Seconds after which the best incumbent is kept
+	:return: Phase durations in seconds (see metrics.PHASES), model size, solution and search statistics
+	"""
+	metrics = SolveMetrics(optimizer.backend_name)
+	_, grouping, _, var_count = optimizer.run_simulation(optimizer.catalog.product_names, time_limit, metrics=metrics)
+	if grouping is None:
+		var_count['status'] = 'NOT_SOLVED'
+	return {
+		'timings': dict(metrics.phases),
+		'var_count': var_count,
+		'model_cache_hit': metrics.model_cache_hit,
+		'nodes': metrics.nodes,
+		'iterations': metrics.iterations
+	}
+
+
+def iter_cases(sizes: List[int], densities: List[float], structures: List[str], builders: List[str],
+               backends: List[str]) -> Iterator:
+	"""
+	:return: Generator of (structure, num_product, density, backend, builder), other backends than scip being run once per matrix
+	"""
+	for structure in structures:
+		for num_product in sizes:
+			for density in densities:
+				for backend in backends:
+					for builder in (builders if backend == 'scip' else [None]):
+						yield structure, num_product, density, backend, builder
+
+
+def git_commit() -> Optional[str]:
+	"""
+	:return: Commit of the working tree, None outside of a git checkout
+	"""
+	try:
+		# The commit of this checkout, wherever the benchmark is run from
+		return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+		                      cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def run_benchmark(output: TextIO, sizes: List[int], densities: List[float], structures: List[str],
+                  builders: List[str], backends: List[str], repeat: int = 1, seed: int = 0, blocks: int = 4,
+                  time_limit: Optional[float] = None, num_search_workers: int = 8, use_presolve: bool = True,
+                  use_reduction: bool = True, model_cache_size: int = 0, solves: int = 1) -> None:
+	"""
+	Run every combination and write one JSON line per solve
+	:param output: Where results are written
+	:param repeat: Number of matrices drawn per combination, with seeds seed, seed + 1, ...
+	:param use_presolve: Passed to ProductOptimizer
+	:param use_reduction: Passed to ProductOptimizer
+	:param model_cache_size: Megabytes of models kept in memory by the scip backend, see ProductOptimizer
+	:param solves: Number of solves of each matrix by the same optimizer, later ones may load a cached model
+	"""
+	commit = git_commit()
+	for structure, num_product, density, backend, builder in iter_cases(sizes, densities, structures, builders,
+	                                                                      backends):
+		for run in range(repeat):
+			catalog = make_catalog(structure, num_product, density, seed + run, blocks)
+			with tempfile.TemporaryDirectory() as directory:
+				catalog_path = os.path.join(directory, 'catalog.npy')
+				catalog.to_binary(catalog_path)
+				# No result cache, every solve is measured
+				optimizer = ProductOptimizer(catalog_path, builder=builder or 'vectorized', use_presolve=use_presolve,
+				                             backend=backend, num_search_workers=num_search_workers, cache_size=0,
+				                             use_reduction=use_reduction, model_cache_size=model_cache_size)
+				for solve in range(solves):
+					result = {
+						'commit': commit,
+						'structure': structure,
+						'num_product': num_product,
+						'density': density,
+						'blocks': blocks if structure == 'block' else None,
+						'seed': seed + run,
+						'backend': backend,
+						'builder': builder,
+						'time_limit': time_limit,
+						'presolve': use_presolve,
+						'reduction': use_reduction,
+						'solve': solve
+					}
+					result.update(run_case(optimizer, time_limit))
+					output.write(json.dumps(result, default=int) + '\n')
+					output.flush()
+				optimizer.reset()
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Mesure le temps de chaque phase sur des matrices synthétiques")
+	parser.add_argument('--sizes', type=int, nargs='+', default=[20, 40, 80],
+	                    help="Nombres de produits")
+	parser.add_argument('--densities', type=float, nargs='+', default=[0.3, 0.6, 0.9],
+	                    help="Probabilités de compatibilité entre deux produits")
+	parser.add_argument('--structures', type=str, nargs='+', default=list(STRUCTURES), choices=STRUCTURES,
+	                    help="Matrices aléatoires uniformes ou par familles de produits")
+	parser.add_argument('--blocks', type=int, default=4,
+	                    help="Nombre de familles des matrices par blocs")
+	parser.add_argument('--builders', type=str, nargs='+', default=sorted(MODEL_BUILDERS), choices=sorted(MODEL_BUILDERS),
+	                    help="Moteurs de construction du modèle (backend scip)")
+	parser.add_argument('--backends', type=str, nargs='+', default=['scip'], choices=BACKENDS,
+	                    help="Solveurs comparés")
+	parser.add_argument('--repeat', type=int, default=1,
+	                    help="Nombre de matrices tirées par combinaison")
+	parser.add_argument('--seed', type=int, default=0,
+	                    help="Graine de la première matrice")
+	parser.add_argument('-T', '--time_limit', type=float, default=30,
+	                    help="Temps de résolution maximal en secondes")
+	parser.add_argument('-W', '--num_search_workers', type=int, default=8,
+	                    help="Nombre de workers parallèles pour le backend cp-sat")
+	parser.add_argument('--no-presolve', dest='presolve', action='store_false',
+	                    help="Toujours résoudre le MIP, sans borne de coloration ni de clique")
+	parser.add_argument('--no-reduction', dest='reduction', action='store_false',
+	                    help="Garder les produits compatibles avec tous les autres ou dominés dans le modèle")
+	parser.add_argument('--model_cache_size', type=int, default=0,
+	                    help="Taille en Mo des modèles construits gardés en mémoire (0 : pas de cache mémoire)")
+	parser.add_argument('--solves', type=int, default=1,
+	                    help="Nombre de résolutions de chaque matrice par le même optimiseur")
+	parser.add_argument('-o', '--output', type=str, default='-',
+	                    help="Fichier JSONL auquel les résultats sont ajoutés ('-' pour la sortie standard)")
+	args = parser.parse_args()
+	output = sys.stdout if args.output == '-' else open(args.output, 'a')
+	try:
+		run_benchmark(output, args.sizes, args.densities, args.structures, args.builders, args.backends,
+		              repeat=args.repeat, seed=args.seed, blocks=args.blocks, time_limit=args.time_limit,
+		              num_search_workers=args.num_search_workers, use_presolve=args.presolve,
+		              use_reduction=args.reduction, model_cache_size=args.model_cache_size, solves=args.solves)
+	finally:
+		if output is not sys.stdout:
+			output.close()
@@ -0,0 +1,222 @@
+import argparse
+import json
+import os
+import numpy as np
+from typing import Dict, List, Optional
+from presolve import clique_cover
+from result_cache import matrix_hash
+
+
+class UnknownProductsError(ValueError):
+	"""
+	Requested products missing from the catalog
+	"""
+	def __init__(self, names: List):
+		"""
+		:param names: Missing names, in request order
+		"""
+		# names as only argument, so that the error survives pickling between processes
+		super().__init__(list(names))
+		self.names = list(names)
+
+	def __str__(self) -> str:
+		return 'unknown products: {0}'.format(', '.join(map(str, self.names)))
+
+
+class CompatibilityCatalog:
+	"""
+	Loaded retention matrix: a name -> index map and a contiguous boolean matrix,
+	selections are extracted with a single fancy-index operation.
+	A catalog loaded from the binary format keeps its rows bit-packed in a memory map,
+	only the rows of the selected products are read from disk.
+	"""
+	def __init__(self, matrix, product_names: List, packed: Optional[np.ndarray] = None,
+	             digest: Optional[str] = None):
+		"""
+		:param matrix: Full compatibility matrix, 1 meaning compatible (None when packed is given)
+		:param product_names: Name of each row/column
+		:param packed: Rows bit-packed with np.packbits, used instead of matrix
+		:param digest: matrix_hash of the catalog when already known
+		"""
+		self.product_names = list(product_names)
+		self.packed = packed
+		self._matrix = None
+		if packed is None:
+			self._matrix = np.ascontiguousarray(np.asarray(matrix) == 1)
+		self._digest = digest
+		self._cliques = None
+		# Like the previous linear scans, a duplicated name resolves to its last column
+		self.index = {name: i for i, name in enumerate(self.product_names)}
+
+	@property
+	def matrix(self) -> np.ndarray:
+		"""Full boolean matrix, unpacked on first access for a binary catalog"""
+		if self._matrix is None:
+			self._matrix = np.unpackbits(self.packed, axis=1, count=len(self.product_names)).astype(bool)
+		return self._matrix
+
+	def fingerprint(self) -> str:
+		"""
+		:return: matrix_hash of the catalog, read from the binary header when available
+		"""
+		if self._digest is None:
+			self._digest = matrix_hash(self.matrix, self.product_names)
+		return self._digest
+
+	def clique_cover(self) -> List[List[int]]:
+		"""
+		Maximal cliques covering the incompatibility graph of the whole catalog, computed once
+		:return: Cliques of catalog indexes
+		"""
+		if self._cliques is None:
+			matrix = self.matrix
+			incompatible = ~(matrix & matrix.T)
+			np.fill_diagonal(incompatible, False)
+			self._cliques = clique_cover([set(np.flatnonzero(row).tolist()) for row in incompatible])
+		return self._cliques
+
+	def selection_cliques(self, product_list: List[int]) -> Optional[List[List[int]]]:
+		"""
+		Restrict the catalog clique cover to a selection, every incompatible pair of the selection
+		stays covered since restricted cliques are still cliques
+		:param product_list: Product indexes
+		:return: Cliques of positions in product_list, None when a product is selected twice
+		"""
+		position = {index: p for p, index in enumerate(product_list)}
+		if len(position) != len(product_list):
+			return None
+		cliques = set()
+		for clique in self.clique_cover():
+			members = tuple(sorted(position[index] for index in clique if index in position))
+			if len(members) > 1:
+				cliques.add(members)
+		return [list(members) for members in sorted(cliques)]
+
+	@classmethod
+	def from_csv(cls, csv_path: str) -> 'CompatibilityCatalog':
+		"""
+		:param csv_path: Path to csv containing data
+		:return: Catalog of the csv
+		"""
+		import pandas as pd
+		df = pd.read_csv(csv_path, sep=",")
+		return cls(df.values, df.columns.to_list())
+
+	@classmethod
+	def from_binary(cls, npy_path: str) -> 'CompatibilityCatalog':
+		"""
+		Memory-map a catalog written by to_binary
+		:param npy_path: Path of the bit-packed .npy matrix, names are read from the .names.json next to it
+		:return: Catalog of the file
+		"""
+		with open(names_path(npy_path)) as names_file:
+			header = json.load(names_file)
+		packed = np.load(npy_path, mmap_mode='r')
+		return cls(None, header['names'], packed=packed, digest=header['matrix_hash'])
+
+	@classmethod
+	def load(cls, path: str) -> 'CompatibilityCatalog':
+		"""
+		Load a catalog, preferring an up to date binary conversion of a csv
+		:param path: Path to a csv or a .npy written by to_binary
+		:return: Catalog
+		"""
+		if path.endswith('.npy'):
+			return cls.from_binary(path)
+		npy_path = os.path.splitext(path)[0] + '.npy'
+		if os.path.exists(npy_path) and os.path.exists(names_path(npy_path)) \
+				and os.path.getmtime(npy_path) >= os.path.getmtime(path):
+			return cls.from_binary(npy_path)
+		return cls.from_csv(path)
+
+	def to_binary(self, npy_path: str) -> None:
+		"""
+		Write the bit-packed matrix and its names index
+		:param npy_path: Path of the .npy matrix
+		"""
+		np.save(npy_path, np.packbits(self.matrix, axis=1))
+		with open(names_path(npy_path), 'w') as names_file:
+			json.dump({'names': self.product_names, 'matrix_hash': self.fingerprint()}, names_file)
+
+	def get_product_list(self, list_name: List) -> List[int]:
+		"""
+		Search needed products in the catalog
+		:param list_name: List of products to extract
+		:return: List of found product indexes
+		"""
+		list_index = []
+		for name in list_name:
+			index = self.index.get(name)
+			if index is None:
+				print("Wrong product name - {0} - Problem might not be solvable \n".format(name))
+			else:
+				list_index.append(index)
+		return list_index
+
+	def unknown_names(self, list_name: List) -> List:
+		"""
+		:param list_name: Requested products
+		:return: Names missing from the catalog, in request order
+		"""
+		return [name for name in list_name if name not in self.index]
+
+	def submatrix(self, product_list: List[int]) -> np.ndarray:
+		"""
+		:param product_list: Product indexes
+		:return: Boolean compatibility matrix of the products
+		"""
+		product_list = np.asarray(product_list, dtype=np.intp)
+		if self._matrix is None:
+			rows = np.unpackbits(self.packed[product_list], axis=1, count=len(self.product_names))
+			return rows[:, product_list].astype(bool)
+		return self._matrix[np.ix_(product_list, product_list)]
+
+	def create_data_model(self, list_name: List, with_cliques: bool = False) -> Dict:
+		"""
+		Build the data matrix of a selection
+		:param list_name: List of products to use
+		:param with_cliques: Add the incompatibility cliques of the selection, see selection_cliques
+		:return: Data needed for computation
+		"""
+		return self.create_data_matrix(self.get_product_list(list_name), list_name, with_cliques)
+
+	def create_data_matrix(self, product_list: List[int], list_name: List, with_cliques: bool = False) -> Dict:
+		"""
+		:param product_list: Indexes of the found products
+		:param list_name: List of products to use
+		:param with_cliques: Add the incompatibility cliques of the selection under 'cliques'
+		:return: Data needed for computation, comp_matrix being nested lists of 0/1
+		"""
+		matrix = self.submatrix(product_list).astype(np.int8).tolist()
+		data = {
+			"comp_matrix": matrix,
+			"num_product": len(matrix),
+			'name_product': list_name
+		}
+		# Si aucun nom, on met juste des numéros de produits
+		if len(data['name_product']) == 0:
+			data['name_product'] = range(data['num_product'])
+		if with_cliques:
+			cliques = self.selection_cliques(product_list)
+			if cliques is not None:
+				data['cliques'] = cliques
+		return data
+
+
+def names_path(npy_path: str) -> str:
+	"""
+	:param npy_path: Path of a binary matrix
+	:return: Path of its names index
+	"""
+	return os.path.splitext(npy_path)[0] + '.names.json'
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Convertit la matrice de compatibilité CSV au format binaire")
+	parser.add_argument('csv_path', type=str, help="Fichier CSV contenant la matrice de compatibilité")
+	parser.add_argument('-o', '--output', type=str, default=None,
+	                    help="Fichier .npy produit (par défaut à côté du CSV)")
+	args = parser.parse_args()
+	output = args.output or os.path.splitext(args.csv_path)[0] + '.npy'
+	CompatibilityCatalog.from_csv(args.csv_path).to_binary(output)
+	print("Wrote {0} and {1}".format(output, names_path(output)))
@@ -0,0 +1,260 @@
+from ortools.linear_solver import pywraplp
+import math
+import time
+import numpy as np
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from metrics import SolveMetrics
+from presolve import accepts_own_groups, coloring_to_pairs, dsatur_coloring, solution_info
+
+EPSILON = 1e-6
+
+
+def extend_column(compatible: np.ndarray, members: List[int], order: List[int]) -> List[int]:
+	"""
+	Grow a set of mutually compatible products until no product can join it
+	:param compatible: Symmetric boolean compatibility matrix
+	:param members: Mutually compatible products
+	:param order: Products in the order they are tried
+	:return: Sorted maximal set containing members
+	"""
+	members = list(members)
+	mask = np.logical_and.reduce(compatible[members], axis=0)
+	mask[members] = False
+	for v in order:
+		if mask[v]:
+			members.append(v)
+			mask &= compatible[v]
+	return sorted(members)
+
+
+def max_weight_column(adjacency: List[Set[int]], weights: np.ndarray,
+                      node_limit: int = 100000) -> Tuple[List[int], float, bool]:
+	"""
+	Branch and bound maximum weight set of mutually compatible products, pruned with the weight
+	of the heaviest product of each class of a greedy partition into mutually incompatible products
+	:param adjacency: Incompatibility adjacency sets
+	:param weights: Weight of each product, only positive ones are searched
+	:param node_limit: Number of search nodes after which the best set found so far is returned
+	:return: Best set, its weight and whether it is proven maximum
+	"""
+	best, best_weight = [], 0.0
+	nodes = 0
+
+	def class_bound(candidates):
+		# A compatible set takes at most one product from each class of pairwise incompatible products
+		classes = []
+		for v in candidates:
+			for product_class in classes:
+				if all(u in adjacency[v] for u in product_class):
+					product_class.append(v)
+					break
+			else:
+				classes.append([v])
+		order, bounds, total = [], [], 0.0
+		for product_class in classes:
+			total += max(weights[v] for v in product_class)
+			for v in product_class:
+				order.append(v)
+				bounds.append(total)
+		return order, bounds
+
+	def expand(chosen, weight, candidates):
+		nonlocal best, best_weight, nodes
+		order, bounds = class_bound(candidates)
+		for index in range(len(order) - 1, -1, -1):
+			nodes += 1
+			if nodes > node_limit or weight + bounds[index] <= best_weight + EPSILON:
+				return
+			v = order[index]
+			new_chosen = chosen + [v]
+			new_weight = weight + weights[v]
+			new_candidates = [u for u in order[:index] if u not in adjacency[v]]
+			if new_candidates:
+				expand(new_chosen, new_weight, new_candidates)
+			elif new_weight > best_weight:
+				best, best_weight = new_chosen, new_weight
+
+	vertices = sorted(np.flatnonzero(weights > EPSILON).tolist(), key=lambda v: weights[v], reverse=True)
+	expand([], 0.0, vertices)
+	return sorted(best), best_weight, nodes <= node_limit
+
+
+class ColumnGenerationBackend:
+	"""
+	Set-partitioning engine for large selections: each column is a set of mutually compatible products.
+	The restricted master LP is solved by GLOP, new columns are priced as maximum weight compatible sets
+	under its duals, and the integer grouping is searched by SCIP over the generated columns (price and branch).
+	The grouping is reported OPTIMAL only when it reaches the column generation lower bound.
+	"""
+	name = 'colgen'
+
+	def __init__(self, max_rounds: int = 1000, columns_per_round: int = 10, node_limit: int = 100000):
+		"""
+		:param max_rounds: Maximum number of pricing rounds
+		:param columns_per_round: Number of greedy seeds tried per round
+		:param node_limit: Search nodes of the exact pricing
+		"""
+		self.max_rounds = max_rounds
+		self.columns_per_round = columns_per_round
+		self.node_limit = node_limit
+
+	def release(self, solver) -> None:
+		"""Master solvers are created per solve, there is nothing to give back"""
+
+	def solve(self, data: Dict, bounds: Optional[Dict] = None, hint: Optional[List[int]] = None,
+	          time_limit: Optional[float] = None, relative_gap: Optional[float] = None,
+	          progress: Optional[Callable] = None, handle=None, metrics: Optional[SolveMetrics] = None) -> Tuple:
+		"""
+		Generate columns, then group the products with the best integer combination of them
+		:param data: Data matrix
+		:param bounds: Presolve result, its lower bound and coloring are reused
+		:param hint: Feasible grouping (group id per product) seeding the columns, defaults to the presolve coloring
+		:param time_limit: Seconds after which the best grouping is returned
+		:param relative_gap: Relative gap at which the integer search stops
+		:param progress: Called with (objective, best_bound, seconds) when the bounds improve
+		:param handle: backends.SolveHandle used by another thread to interrupt the solve
+		:param metrics: Receives the build (pricing), solve and extraction times
+		:return: Integer master solver, pair_product_group_list and var_count (num_group counting columns)
+		"""
+		metrics = metrics if metrics is not None else SolveMetrics()
+		start = time.perf_counter()
+		deadline = start + time_limit if time_limit is not None else None
+		num_product = data['num_product']
+		allowed = np.asarray(data['comp_matrix']).reshape(num_product, num_product) == 1
+		if not accepts_own_groups(allowed):
+			from backends import ScipBackend
+			return ScipBackend('sparse', pool_size=0).solve(data, bounds, hint, time_limit, relative_gap, progress, handle,
+			                                                   metrics)
+
+		with metrics.phase('build'):
+			compatible = allowed & allowed.T
+			adjacency = [set(np.flatnonzero(~row).tolist()) - {i} for i, row in enumerate(compatible)]
+			if hint is None and bounds is not None:
+				hint = bounds['coloring']
+			if hint is None:
+				hint = dsatur_coloring(adjacency)
+			lower_bound = bounds['lower_bound'] if bounds is not None else 1
+
+			columns = []
+			known = {}
+
+			def add_column(members):
+				column = tuple(members)
+				if column not in known:
+					known[column] = len(columns)
+					columns.append(column)
+				return known[column]
+
+			# Two colors may grow into the same maximal column, the hint then needs fewer groups
+			initial = sorted({add_column(extend_column(compatible, [i for i in range(num_product) if hint[i] == color],
+			                                           list(range(num_product))))
+			                  for color in set(hint)})
+			upper_bound = len(initial)
+
+			master = pywraplp.Solver.CreateSolver('GLOP')
+			infinity = master.infinity()
+			cover = [master.Constraint(1, infinity) for _ in range(num_product)]
+			master_vars = []
+
+			def add_to_master(column):
+				var = master.NumVar(0, infinity, 'column[%d]' % len(master_vars))
+				master.Objective().SetCoefficient(var, 1)
+				for i in column:
+					cover[i].SetCoefficient(var, 1)
+				master_vars.append(var)
+
+			for column in columns:
+				add_to_master(column)
+			master.Objective().SetMinimization()
+
+		cancelled = False
+		for _ in range(self.max_rounds):
+			if lower_bound >= upper_bound:
+				break
+			if (deadline is not None and time.perf_counter() >= deadline) or (handle is not None and handle.cancelled):
+				cancelled = handle is not None and handle.cancelled
+				break
+			with metrics.phase('solve'):
+				status = master.Solve()
+			if status != pywraplp.Solver.OPTIMAL:
+				break
+			lp_value = master.Objective().Value()
+			duals = np.array([constraint.dual_value() for constraint in cover])
+
+			with metrics.phase('build'):
+				order = np.argsort(-duals, kind='stable').tolist()
+				new_columns = []
+				for seed in order[:self.columns_per_round]:
+					column = extend_column(compatible, [seed], order)
+					if duals[column].sum() > 1 + EPSILON:
+						new_columns.append(column)
+				if not new_columns:
+					members, weight, proven = max_weight_column(adjacency, duals, self.node_limit)
+					if weight > 1 + EPSILON:
+						new_columns.append(extend_column(compatible, members, order))
+					if proven:
+						# Farley bound, the LP value itself once no column prices out
+						new_bound = math.ceil(lp_value / max(weight, 1) - EPSILON)
+						if new_bound > lower_bound:
+							lower_bound = new_bound
+							if progress is not None:
+								progress(upper_bound, lower_bound, time.perf_counter() - start)
+				num_columns = len(columns)
+				for column in new_columns:
+					add_column(column)
+				for column in columns[num_columns:]:
+					add_to_master(column)
+			if len(columns) == num_columns:
+				break
+
+		with metrics.phase('build'):
+			integer_master = pywraplp.Solver.CreateSolver('SCIP')
+			choice = [integer_master.BoolVar('column[%d]' % c) for c in range(len(columns))]
+			integer_cover = [integer_master.Constraint(1, integer_master.infinity()) for _ in range(num_product)]
+			for c, column in enumerate(columns):
+				for i in column:
+					integer_cover[i].SetCoefficient(choice[c], 1)
+			integer_master.Minimize(integer_master.Sum(choice))
+			opened = set(initial)
+			integer_master.SetHint(choice, [float(c in opened) for c in range(len(columns))])
+		var_count = {
+			'num_group': len(columns),
+			'num_compat_var': sum(len(column) for column in columns),
+			'num_constraints': integer_master.NumConstraints()
+		}
+
+		chosen = initial
+		if lower_bound < upper_bound and not cancelled:
+			if deadline is not None:
+				integer_master.SetTimeLimit(max(1, int((deadline - time.perf_counter()) * 1000)))
+			parameters = pywraplp.MPSolverParameters()
+			if relative_gap is not None:
+				parameters.SetDoubleParam(pywraplp.MPSolverParameters.RELATIVE_MIP_GAP, relative_gap)
+			if handle is not None and not handle.attach(integer_master.InterruptSolve):
+				return integer_master, None, var_count
+			with metrics.phase('solve'):
+				status = integer_master.Solve(parameters)
+			if handle is not None:
+				handle.detach()
+			metrics.add_search(integer_master.nodes(), integer_master.iterations())
+			if status in (pywraplp.Solver.OPTIMAL, pywraplp.Solver.FEASIBLE):
+				selected = [c for c in range(len(columns)) if choice[c].solution_value() > 0.5]
+				if len(selected) < len(chosen):
+					chosen = selected
+		elif cancelled:
+			return integer_master, None, var_count
+
+		with metrics.phase('extraction'):
+			# Columns may overlap, each product stays in the first chosen column covering it
+			coloring = [None] * num_product
+			for c in chosen:
+				for i in columns[c]:
+					if coloring[i] is None:
+						coloring[i] = c
+			pair_product_group_list = coloring_to_pairs(coloring)
+		num_groups = len(set(coloring))
+		var_count.update(solution_info('OPTIMAL' if num_groups <= lower_bound else 'FEASIBLE', num_groups,
+		                               min(lower_bound, num_groups)))
+		if progress is not None:
+			progress(var_count['objective'], var_count['best_bound'], time.perf_counter() - start)
+		return integer_master, pair_product_group_list, var_count
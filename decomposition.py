@@ -0,0 +1,128 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+from presolve import accepts_own_groups, incompatibility_graph, presolve, proven_var_count, solution_info
+
+
+def connected_components(adjacency: List[Set[int]]) -> List[List[int]]:
+	"""
+	Split the incompatibility graph into connected components
+	:param adjacency: Adjacency sets
+	:return: Sorted vertex lists, in order of their smallest vertex
+	"""
+	seen = [False] * len(adjacency)
+	components = []
+	for start in range(len(adjacency)):
+		if seen[start]:
+			continue
+		seen[start] = True
+		component = [start]
+		stack = [start]
+		while stack:
+			for neighbour in adjacency[stack.pop()]:
+				if not seen[neighbour]:
+					seen[neighbour] = True
+					component.append(neighbour)
+					stack.append(neighbour)
+		components.append(sorted(component))
+	return components
+
+
+def sub_data_model(data: Dict, products: List[int]) -> Dict:
+	"""
+	Restrict a data matrix to some products
+	:param data: Data matrix
+	:param products: Indexes of the products to keep
+	:return: Data matrix of the selection
+	"""
+	return {
+		'comp_matrix': [[data['comp_matrix'][i][j] for j in products] for i in products],
+		'num_product': len(products),
+		'name_product': [data['name_product'][i] for i in products]
+	}
+
+
+def _solve_component(backend, data: Dict, use_presolve: bool, time_limit: Optional[float] = None,
+                     relative_gap: Optional[float] = None) -> Tuple[List, Dict]:
+	"""
+	Group the products of one component
+	:param backend: Solving backend
+	:param data: Data matrix of the component
+	:param use_presolve: Try coloring and clique bounds first
+	:param time_limit: Seconds given to the backend
+	:param relative_gap: Relative gap at which the backend stops
+	:return: pair_product_group_list of the component and its var_count
+	"""
+	bounds = None
+	if use_presolve:
+		bounds = presolve(data)
+		if bounds['pair_product_group_list'] is not None:
+			return bounds['pair_product_group_list'], proven_var_count(bounds['upper_bound'])
+	_, pair_product_group_list, var_count = backend.solve(data, bounds, time_limit=time_limit,
+	                                                      relative_gap=relative_gap)
+	return pair_product_group_list, var_count
+
+
+def solve_decomposed(data: Dict, backend, use_presolve: bool = True, max_workers: Optional[int] = None,
+                     time_limit: Optional[float] = None, relative_gap: Optional[float] = None) -> Tuple[List, Dict]:
+	"""
+	Solve each non-trivial component of the incompatibility graph on its own and merge the groups.
+	Products of different components are compatible, so the r-th group of every component
+	can share a single group, and products compatible with everything join the first one.
+	:param data: Data matrix
+	:param backend: Solving backend, must be picklable when several components need a solve
+	:param use_presolve: Try coloring and clique bounds on each component first
+	:param max_workers: Size of the process pool, defaults to the number of CPUs
+	:param time_limit: Seconds given to each component
+	:param relative_gap: Relative gap at which each component stops
+	:return: pair_product_group_list over the whole selection and summed var_count
+	"""
+	num_product = data['num_product']
+	if accepts_own_groups(data['comp_matrix']):
+		components = connected_components(incompatibility_graph(data['comp_matrix']))
+		isolated = [component[0] for component in components if len(component) == 1]
+		components = [component for component in components if len(component) > 1]
+	else:
+		# Solved as a whole, as merging groups across components relies on colorings
+		components, isolated = [list(range(num_product))], []
+
+	sub_models = [sub_data_model(data, component) for component in components]
+	if len(sub_models) > 1:
+		with ProcessPoolExecutor(max_workers=max_workers) as executor:
+			futures = [executor.submit(_solve_component, backend, sub_model, use_presolve, time_limit, relative_gap)
+			           for sub_model in sub_models]
+			results = [future.result() for future in futures]
+	else:
+		results = [_solve_component(backend, sub_model, use_presolve, time_limit, relative_gap)
+		           for sub_model in sub_models]
+
+	var_count = {'num_group': 0, 'num_compat_var': 0, 'num_constraints': 0}
+	status, best_bound = 'OPTIMAL', 1 if isolated else 0
+	merged_groups = []
+	for component, (pair_product_group_list, component_count) in zip(components, results):
+		if pair_product_group_list is None:
+			return None, var_count
+		for key in ('num_group', 'num_compat_var', 'num_constraints'):
+			var_count[key] += component_count[key]
+		# The selection needs as many groups as its hardest component
+		if component_count['status'] != 'OPTIMAL':
+			status = 'FEASIBLE'
+		best_bound = max(best_bound, component_count['best_bound'])
+		labels = sorted({group for _, group in pair_product_group_list})
+		rank = {label: r for r, label in enumerate(labels)}
+		for local_index, group in pair_product_group_list:
+			while len(merged_groups) <= rank[group]:
+				merged_groups.append([])
+			merged_groups[rank[group]].append(component[local_index])
+	if isolated:
+		if not merged_groups:
+			merged_groups.append([])
+		merged_groups[0].extend(isolated)
+
+	# Every member of a merged group is compatible with its smallest product, which labels the group
+	representatives = [min(members) for members in merged_groups]
+	min_index_group = min(representatives, default=0)
+	pair_product_group_list = [[i, representative - min_index_group]
+	                           for representative, members in zip(representatives, merged_groups)
+	                           for i in members]
+	var_count.update(solution_info(status, len(merged_groups), best_bound))
+	return sorted(pair_product_group_list, key=lambda x: x[1]), var_count
@@ -0,0 +1,70 @@
+import numpy as np
+from typing import Iterator, List, Optional, Sequence
+
+
+class Grouping:
+	"""
+	Result of a run: the group of every product in one array, groups being numbered from 0 in the order
+	of their smallest product, with the group sizes and the members already ordered by group.
+	Iterating yields the [product, group] pairs of the former pair_product_group_list, sorted by group.
+	"""
+	__slots__ = ('group_of', 'sizes', 'order', 'objective', 'status')
+
+	def __init__(self, group_of: Sequence[int], status: Optional[str] = None):
+		"""
+		:param group_of: Group label of each product, any hashable ints
+		:param status: 'OPTIMAL' or 'FEASIBLE'
+		"""
+		labels = np.asarray(group_of, dtype=np.int64)
+		_, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+		rank = np.empty(len(first), dtype=np.int32)
+		rank[np.argsort(first, kind='stable')] = np.arange(len(first), dtype=np.int32)
+		self.group_of = rank[inverse.reshape(-1)]
+		self.sizes = np.bincount(self.group_of, minlength=len(first)).astype(np.int32)
+		self.order = np.argsort(self.group_of, kind='stable').astype(np.int32)
+		self.objective = len(first)
+		self.status = status
+
+	@classmethod
+	def from_pairs(cls, pair_product_group_list: List, num_product: int, status: Optional[str] = None) -> 'Grouping':
+		"""
+		:param pair_product_group_list: List of [product, group]
+		:param num_product: Number of products
+		:param status: 'OPTIMAL' or 'FEASIBLE'
+		:return: Grouping of the pairs
+		"""
+		group_of = np.zeros(num_product, dtype=np.int64)
+		if len(pair_product_group_list):
+			pairs = np.asarray(pair_product_group_list, dtype=np.int64)
+			group_of[pairs[:, 0]] = pairs[:, 1]
+		return cls(group_of, status)
+
+	def members(self) -> List[np.ndarray]:
+		"""
+		:return: Product indexes of each group, in group order
+		"""
+		if self.objective == 0:
+			return []
+		return np.split(self.order, np.cumsum(self.sizes)[:-1])
+
+	def names(self, name_product: Sequence) -> List[List]:
+		"""
+		:param name_product: Name of each product
+		:return: Product names of each group, in group order
+		"""
+		return [[name_product[i] for i in members] for members in self.members()]
+
+	def to_pairs(self) -> List[List[int]]:
+		"""
+		:return: pair_product_group_list, sorted by group
+		"""
+		return np.column_stack((self.order, self.group_of[self.order])).tolist()
+
+	def __iter__(self) -> Iterator[List[int]]:
+		return iter(self.to_pairs())
+
+	def __len__(self) -> int:
+		return len(self.group_of)
+
+	def __repr__(self) -> str:
+		return 'Grouping({0} products, {1} groups, {2})'.format(len(self.group_of), self.objective, self.status)
@@ -0,0 +1,384 @@
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+
+class JobQueue:
+	"""
+	Grouping jobs shared by several hosts through one SQLite file, e.g. on a shared volume, without any service.
+	A worker claims the oldest job available with a lease that it renews while solving. When a worker dies,
+	its lease expires and the job is claimed again by another worker, up to max_attempts claims.
+	Results and metrics are written back in the same row, where the submitter waits for them.
+	The file uses the default rollback journal, WAL does not work across hosts.
+	"""
+	def __init__(self, path: str, max_attempts: int = 3, timeout: float = 30.0):
+		"""
+		:param path: SQLite file of the queue, created when missing
+		:param max_attempts: Number of claims of a job before it is failed, a job is claimed again when its lease expires
+		:param timeout: Seconds to wait for another host holding the file lock
+		"""
+		self.path = path
+		self.max_attempts = max_attempts
+		self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+		self.lock = threading.Lock()
+		self.connection.execute("CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+		                        "products TEXT, time_limit REAL, relative_gap REAL, status TEXT, worker TEXT, "
+		                        "lease_until REAL, attempts INTEGER DEFAULT 0, result TEXT, metrics TEXT, error TEXT, "
+		                        "submitted REAL, finished REAL)")
+		self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+
+	def submit(self, products: List, time_limit: Optional[float] = None, relative_gap: Optional[float] = None) -> int:
+		"""
+		:param products: List of products to group
+		:param time_limit: Solver time limit, None for the worker default
+		:param relative_gap: Relative gap at which the search stops, None for the worker default
+		:return: Job id
+		"""
+		return self.submit_many([{'products': products, 'time_limit': time_limit, 'relative_gap': relative_gap}])[0]
+
+	def submit_many(self, jobs: Iterable[Dict]) -> List[int]:
+		"""
+		Submit several jobs in one transaction
+		:param jobs: Jobs {"products", "time_limit", "relative_gap"}, as read by batch.read_jobs
+		:return: Job ids, in the same order
+		"""
+		now = time.time()
+		ids = []
+		with self.lock:
+			self.connection.execute("BEGIN IMMEDIATE")
+			try:
+				for job in jobs:
+					cursor = self.connection.execute(
+						"INSERT INTO jobs (products, time_limit, relative_gap, status, submitted) VALUES (?, ?, ?, ?, ?)",
+						(json.dumps(list(job['products'])), job.get('time_limit'), job.get('relative_gap'), PENDING, now))
+					ids.append(cursor.lastrowid)
+				self.connection.execute("COMMIT")
+			except BaseException:
+				self.connection.execute("ROLLBACK")
+				raise
+		return ids
+
+	def claim(self, worker: str, lease: float) -> Optional[Dict]:
+		"""
+		Take the oldest pending job, or the oldest running one whose lease expired
+		:param worker: Name of the claiming worker
+		:param lease: Seconds the job is reserved for, see renew
+		:return: Job {"id", "products", "time_limit", "relative_gap", "attempts"}, None when there is nothing to do
+		"""
+		with self.lock:
+			self.connection.execute("BEGIN IMMEDIATE")
+			try:
+				while True:
+					now = time.time()
+					row = self.connection.execute(
+						"SELECT id, products, time_limit, relative_gap, attempts FROM jobs WHERE status = ? "
+						"OR (status = ? AND lease_until < ?) ORDER BY id LIMIT 1", (PENDING, RUNNING, now)).fetchone()
+					if row is None:
+						job = None
+						break
+					job_id, products, time_limit, relative_gap, attempts = row
+					if attempts >= self.max_attempts:
+						# Its workers kept dying, most likely on this very job
+						self.connection.execute(
+							"UPDATE jobs SET status = ?, error = ?, finished = ?, lease_until = NULL WHERE id = ?",
+							(FAILED, 'lease expired {0} times'.format(attempts), now, job_id))
+						continue
+					self.connection.execute(
+						"UPDATE jobs SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+						(RUNNING, worker, now + lease, job_id))
+					job = {'id': job_id, 'products': json.loads(products), 'time_limit': time_limit,
+					       'relative_gap': relative_gap, 'attempts': attempts + 1}
+					break
+				self.connection.execute("COMMIT")
+			except BaseException:
+				self.connection.execute("ROLLBACK")
+				raise
+		return job
+
+	def renew(self, job_id: int, worker: str, lease: float) -> bool:
+		"""
+		Extend the lease of a running job
+		:return: Whether the worker still holds the job
+		"""
+		return self._update_held(job_id, worker, "lease_until = ?", (time.time() + lease,))
+
+	def complete(self, job_id: int, worker: str, result: Dict, metrics: Optional[Dict] = None) -> bool:
+		"""
+		Write the result of a job
+		:param result: JSON-able result
+		:param metrics: SolveMetrics.as_dict of the run
+		:return: Whether it was written, False when the job was claimed by another worker meanwhile
+		"""
+		return self._update_held(job_id, worker, "status = ?, result = ?, metrics = ?, finished = ?, lease_until = NULL",
+		                         (DONE, json.dumps(result, default=int), json.dumps(metrics, default=int), time.time()))
+
+	def fail(self, job_id: int, worker: str, error: str, metrics: Optional[Dict] = None) -> bool:
+		"""
+		Mark a job failed, it is not retried
+		:param error: Error message
+		:param metrics: SolveMetrics.as_dict of the run, if any
+		:return: Whether it was written
+		"""
+		return self._update_held(job_id, worker, "status = ?, error = ?, metrics = ?, finished = ?, lease_until = NULL",
+		                         (FAILED, error, json.dumps(metrics, default=int), time.time()))
+
+	def release(self, job_id: int, worker: str) -> bool:
+		"""
+		Give a job back without result, e.g. on shutdown, it does not count as an attempt
+		:return: Whether the worker still held the job
+		"""
+		return self._update_held(job_id, worker, "status = ?, worker = NULL, lease_until = NULL, attempts = attempts - 1",
+		                         (PENDING,))
+
+	def _update_held(self, job_id: int, worker: str, assignments: str, values: tuple) -> bool:
+		with self.lock:
+			cursor = self.connection.execute(
+				"UPDATE jobs SET {0} WHERE id = ? AND worker = ? AND status = ?".format(assignments),
+				values + (job_id, worker, RUNNING))
+		return cursor.rowcount == 1
+
+	def get(self, job_id: int) -> Optional[Dict]:
+		"""
+		:param job_id: Job id
+		:return: Job with its status, and its result, error and metrics once finished, None when unknown
+		"""
+		with self.lock:
+			row = self.connection.execute(
+				"SELECT id, products, status, worker, attempts, result, metrics, error, submitted, finished "
+				"FROM jobs WHERE id = ?", (job_id,)).fetchone()
+		if row is None:
+			return None
+		job = dict(zip(('id', 'products', 'status', 'worker', 'attempts', 'result', 'metrics', 'error', 'submitted',
+		                'finished'), row))
+		for field in ('products', 'result', 'metrics'):
+			if job[field] is not None:
+				job[field] = json.loads(job[field])
+		return job
+
+	def wait(self, job_ids: List[int], timeout: Optional[float] = None, poll: float = 0.5) -> Dict[int, Dict]:
+		"""
+		Wait for jobs to finish
+		:param job_ids: Job ids
+		:param timeout: Seconds after which the jobs still running are returned as they are, None for no limit
+		:param poll: Seconds between two checks
+		:return: Job of each id, see get
+		"""
+		deadline = time.time() + timeout if timeout is not None else None
+		jobs = {}
+		waiting = list(job_ids)
+		while True:
+			still_waiting = []
+			for job_id in waiting:
+				job = self.get(job_id)
+				jobs[job_id] = job
+				if job is not None and job['status'] not in (DONE, FAILED):
+					still_waiting.append(job_id)
+			waiting = still_waiting
+			if not waiting or (deadline is not None and time.time() >= deadline):
+				return jobs
+			time.sleep(poll)
+
+	def counts(self) -> Dict[str, int]:
+		"""
+		:return: Number of jobs per status
+		"""
+		with self.lock:
+			rows = self.connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+		return dict(rows)
+
+	def close(self) -> None:
+		self.connection.close()
+
+
+def run_worker(path: str, optimizer_kwargs: Dict, lease: float = 60.0, poll: float = 1.0,
+               time_limit: Optional[float] = None, relative_gap: Optional[float] = None,
+               max_jobs: Optional[int] = None, idle_exit: bool = False, max_attempts: int = 3) -> int:
+	"""
+	Load the catalog once, then solve queued jobs, renewing the lease of the current job in the background
+	:param path: SQLite file of the queue
+	:param optimizer_kwargs: Arguments of ProductOptimizer
+	:param lease: Seconds a claimed job stays reserved without renewal
+	:param poll: Seconds to wait when the queue is empty
+	:param time_limit: Solver time limit of the jobs submitted without one
+	:param relative_gap: Relative gap of the jobs submitted without one
+	:param max_jobs: Number of jobs after which the worker stops, None for no limit
+	:param idle_exit: Stop as soon as the queue is empty
+	:param max_attempts: See JobQueue
+	:return: Number of jobs processed
+	"""
+	# Imported here so that submitting and waiting only needs the standard library
+	from catalog import UnknownProductsError
+	from optimizer import ProductOptimizer
+	optimizer = ProductOptimizer(**optimizer_kwargs)
+	jobs = JobQueue(path, max_attempts=max_attempts)
+	worker = '{0}:{1}'.format(socket.gethostname(), os.getpid())
+	processed = 0
+	try:
+		while max_jobs is None or processed < max_jobs:
+			job = jobs.claim(worker, lease)
+			if job is None:
+				if idle_exit:
+					break
+				time.sleep(poll)
+				continue
+			finished = threading.Event()
+
+			def heartbeat(job_id=job['id']):
+				while not finished.wait(lease / 3):
+					if not jobs.renew(job_id, worker, lease):
+						return
+
+			threading.Thread(target=heartbeat, daemon=True).start()
+			try:
+				_, grouping, data, var_count = optimizer.run_simulation(
+					job['products'], job['time_limit'] if job['time_limit'] is not None else time_limit,
+					job['relative_gap'] if job['relative_gap'] is not None else relative_gap)
+				metrics = optimizer.last_metrics.as_dict()
+				if grouping is None:
+					jobs.fail(job['id'], worker, 'no grouping found', metrics)
+				else:
+					jobs.complete(job['id'], worker, {'groups': grouping.names(data['name_product']),
+					                                  'var_count': var_count}, metrics)
+			except UnknownProductsError as error:
+				jobs.fail(job['id'], worker, str(error))
+			except Exception as error:
+				jobs.fail(job['id'], worker, '{0}: {1}'.format(type(error).__name__, error))
+			except BaseException:
+				jobs.release(job['id'], worker)
+				raise
+			finally:
+				finished.set()
+			processed += 1
+	finally:
+		jobs.close()
+	return processed
+
+
+def _job_line(job: Dict) -> str:
+	if job is None:
+		return json.dumps({'status': 'unknown'})
+	line = {'id': job['id'], 'status': job['status']}
+	if job['status'] == DONE:
+		line.update(job['result'])
+	elif job['status'] == FAILED:
+		line['error'] = job['error']
+	if job['finished'] is not None:
+		line['time'] = job['finished'] - job['submitted']
+	return json.dumps(line)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="File de calcul partagée entre plusieurs machines (SQLite)")
+	parser.add_argument('queue', type=str,
+	                    help="Fichier SQLite de la file, sur un volume partagé")
+	commands = parser.add_subparsers(dest='command', required=True)
+
+	submit = commands.add_parser('submit', help="Soumettre des listes de produits")
+	submit.add_argument('products', metavar='P', type=str, nargs='*',
+	                    help='Liste des produits pour optimization')
+	submit.add_argument('--batch', type=str, default=None,
+	                    help="Fichier JSONL/CSV avec une liste de produits par ligne ('-' pour stdin)")
+	submit.add_argument('-T', '--time_limit', type=float, default=None,
+	                    help="Temps de résolution maximal en secondes")
+	submit.add_argument('-G', '--relative_gap', type=float, default=None,
+	                    help="Écart relatif à la borne à partir duquel la recherche s'arrête")
+	submit.add_argument('--wait', action='store_true',
+	                    help="Attendre les résultats et les écrire en JSON, une ligne par liste")
+
+	wait = commands.add_parser('wait', help="Attendre des calculs déjà soumis")
+	wait.add_argument('ids', metavar='ID', type=int, nargs='+',
+	                  help="Identifiants des calculs")
+	wait.add_argument('--timeout', type=float, default=None,
+	                  help="Temps d'attente maximal en secondes")
+
+	worker = commands.add_parser('worker', help="Traiter les calculs de la file")
+	worker.add_argument('-C', '--csv_path', type=str, default='app/data/retention_pc.csv',
+	                    help="Chemin vers le fichier CSV contenant la matrice de compatibilité")
+	worker.add_argument('-B', '--builder', type=str, default='vectorized',
+	                    help="Moteur de construction du modèle (voir optimizer.py --help)")
+	worker.add_argument('--backend', type=str, default='scip',
+	                    help="Solveur utilisé pour le modèle de regroupement (voir optimizer.py --help)")
+	worker.add_argument('--cache_path', type=str, default=None,
+	                    help="Fichier SQLite conservant les résultats entre deux appels "
+	                         "(par défaut à côté du catalogue, '' pour un cache en mémoire seulement)")
+	worker.add_argument('--model_cache_path', type=str, default=None,
+	                    help="Fichier SQLite conservant les modèles construits entre deux appels")
+	worker.add_argument('--workers', type=int, default=1,
+	                    help="Nombre de processus sur cette machine")
+	worker.add_argument('--lease', type=float, default=60.0,
+	                    help="Durée de réservation d'un calcul en secondes, renouvelée pendant la résolution")
+	worker.add_argument('-T', '--time_limit', type=float, default=None,
+	                    help="Temps de résolution maximal des calculs soumis sans limite")
+	worker.add_argument('-G', '--relative_gap', type=float, default=None,
+	                    help="Écart relatif des calculs soumis sans écart")
+	worker.add_argument('--idle_exit', action='store_true',
+	                    help="S'arrêter dès que la file est vide")
+	args = parser.parse_args()
+
+	if args.command == 'submit':
+		if args.batch is not None:
+			from batch import open_jobs, read_jobs
+			with open_jobs(args.batch) as stream:
+				jobs = list(read_jobs(stream))
+			invalid = ['line {0}: {1}'.format(job['id'], job['error']) for job in jobs if 'error' in job]
+			if invalid:
+				parser.error('; '.join(invalid))
+		elif args.products:
+			jobs = [{'products': args.products}]
+		else:
+			parser.error("a product list or --batch is required")
+		for job in jobs:
+			job.setdefault('time_limit', args.time_limit)
+			job.setdefault('relative_gap', args.relative_gap)
+		queue = JobQueue(args.queue)
+		ids = queue.submit_many(jobs)
+		if args.wait:
+			results = queue.wait(ids)
+			for job_id in ids:
+				print(_job_line(results[job_id]))
+		else:
+			print(json.dumps(ids))
+	elif args.command == 'wait':
+		results = JobQueue(args.queue).wait(args.ids, timeout=args.timeout)
+		for job_id in args.ids:
+			print(_job_line(results[job_id]))
+	else:
+		# Checked here rather than with choices, so that submit and wait do not import the solvers
+		from backends import BACKENDS
+		from model_builder import MODEL_BUILDERS
+		for option, value, choices in (('--builder', args.builder, sorted(MODEL_BUILDERS)),
+		                               ('--backend', args.backend, BACKENDS)):
+			if value not in choices:
+				worker.error("argument {0}: invalid choice: '{1}' (choose from {2})".format(
+					option, value, ', '.join("'{0}'".format(choice) for choice in choices)))
+		optimizer_kwargs = {
+			'retention_csv': args.csv_path,
+			'builder': args.builder,
+			'backend': args.backend,
+			'cache_path': args.cache_path,
+			'model_cache_path': args.model_cache_path
+		}
+		worker_kwargs = {'lease': args.lease, 'time_limit': args.time_limit, 'relative_gap': args.relative_gap,
+		                 'idle_exit': args.idle_exit}
+		if args.workers == 1:
+			run_worker(args.queue, optimizer_kwargs, **worker_kwargs)
+		else:
+			processes = [multiprocessing.Process(target=run_worker, args=(args.queue, optimizer_kwargs),
+			                                     kwargs=worker_kwargs) for _ in range(args.workers)]
+			for process in processes:
+				process.start()
+			try:
+				for process in processes:
+					process.join()
+			except KeyboardInterrupt:
+				# Each worker gives its current job back on its own interrupt
+				for process in processes:
+					process.join()
@@ -0,0 +1,132 @@
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+PHASES = ('load', 'lookup', 'presolve', 'build', 'solve', 'extraction')
+
+MetricsHook = Callable[['SolveMetrics'], None]
+
+
+class SolveMetrics:
+	"""
+	Wall time of each phase of a run and statistics of its solver, filled in as the run goes.
+	Phases: load (selection matrix extraction), lookup (result cache), presolve, build (model construction),
+	solve and extraction (reading the grouping back), a phase that did not happen is absent.
+	"""
+	def __init__(self, backend: Optional[str] = None):
+		"""
+		:param backend: Name of the solving backend
+		"""
+		self.timestamp = time.time()
+		self.backend = backend
+		self.num_product = None
+		self.phases = {}
+		self.cache_hit = False
+		self.model_cache_hit = False
+		self.nodes = None
+		self.iterations = None
+		self.status = None
+		self.objective = None
+		self.best_bound = None
+		self.gap = None
+
+	@contextmanager
+	def phase(self, name: str):
+		"""
+		Time a block, repeated phases (e.g. one build per component) add up
+		:param name: One of PHASES
+		"""
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+	def record_solution(self, var_count: Dict) -> None:
+		"""
+		Copy the solution information of a var_count
+		:param var_count: Model size and solution of the run
+		"""
+		self.status = var_count.get('status')
+		self.objective = var_count.get('objective')
+		self.best_bound = var_count.get('best_bound')
+		self.gap = var_count.get('gap')
+
+	def add_search(self, nodes: Optional[int], iterations: Optional[int]) -> None:
+		"""
+		Add the search statistics of a solver
+		:param nodes: Branch and bound nodes (branches for CP-SAT)
+		:param iterations: Simplex iterations (conflicts for CP-SAT)
+		"""
+		self.nodes = (self.nodes or 0) + nodes
+		self.iterations = (self.iterations or 0) + iterations
+
+	@property
+	def total(self) -> float:
+		"""Wall time of the measured phases in seconds"""
+		return sum(self.phases.values())
+
+	def as_dict(self) -> Dict:
+		"""
+		:return: JSON-able metrics
+		"""
+		return {
+			'timestamp': self.timestamp,
+			'backend': self.backend,
+			'num_product': self.num_product,
+			'phases': dict(self.phases),
+			'total': self.total,
+			'cache_hit': self.cache_hit,
+			'model_cache_hit': self.model_cache_hit,
+			'nodes': self.nodes,
+			'iterations': self.iterations,
+			'status': self.status,
+			'objective': self.objective,
+			'best_bound': self.best_bound,
+			'gap': self.gap
+		}
+
+
+class JsonLinesHook:
+	"""
+	Metrics hook appending one JSON line per run, the file is opened on first use
+	so that the hook can be handed to worker processes
+	"""
+	def __init__(self, path: str):
+		"""
+		:param path: JSONL file, '-' for stderr
+		"""
+		self.path = path
+		self.stream = None
+		self.lock = threading.Lock()
+
+	def __call__(self, metrics: SolveMetrics) -> None:
+		line = json.dumps(metrics.as_dict(), default=int) + '\n'
+		with self.lock:
+			if self.stream is None:
+				self.stream = sys.stderr if self.path == '-' else open(self.path, 'a')
+			self.stream.write(line)
+			self.stream.flush()
+
+	def __getstate__(self) -> Dict:
+		return {'path': self.path}
+
+	def __setstate__(self, state: Dict) -> None:
+		self.__init__(state['path'])
+
+
+def emit(metrics: SolveMetrics, hook: Optional[MetricsHook]) -> None:
+	"""
+	Hand the metrics of a finished run to a hook, a failing hook never fails the run
+	:param metrics: Metrics of the run
+	:param hook: Callable receiving the metrics, None to drop them
+	"""
+	if hook is None:
+		return
+	try:
+		hook(metrics)
+	except Exception as error:
+		print("Metrics hook failed - {0}: {1}".format(type(error).__name__, error), file=sys.stderr)
@@ -0,0 +1,481 @@
+from ortools.linear_solver import linear_solver_pb2, pywraplp
+import numpy as np
+import time
+from typing import Dict, List, Optional, Tuple
+from presolve import accepts_own_groups, clique_cover, incompatibility_graph
+
+
+def create_variables(solver: pywraplp.Solver, num_product: int) -> Tuple[Dict, List, int, int]:
+	"""
+	Create group (Y) and compatibility (X) variables
+	:param solver: Solver receiving the variables
+	:param num_product: Number of products
+	:return: Group variables, compatibility variables and their counts
+	"""
+	# Creating group variables, with 0 product each (Y)
+	group = {}
+	for i in range(num_product):
+		group[i] = solver.IntVar(0, 1, 'group[%d]' % i)
+	num_group = solver.NumVariables()
+
+	# Creating compatibility variables (X)
+	comp_var = []
+	for i in range(num_product):
+		comp_var.append([])
+		for j in range(num_product):
+			comp_var[i].append(solver.IntVar(0, 1, "comp_var[{0}][{1}]".format(i, j)))
+	num_compat_var = solver.NumVariables() - num_product
+	return group, comp_var, num_group, num_compat_var
+
+
+def set_objective(solver: pywraplp.Solver, group: Dict) -> None:
+	"""
+	Minimize the number of opened groups
+	:param solver: Solver holding the model
+	:param group: Group variables (Y)
+	"""
+	objective = solver.Objective()
+	for j in range(len(group)):
+		objective.SetCoefficient(group[j], 1)
+	objective.SetMinimization()
+
+
+def finish_model(solver: pywraplp.Solver, group: Dict, num_group: int, num_compat_var: int, timings: Optional[Dict],
+                 start: float, variables_created: float) -> Dict:
+	"""
+	Common end of the builders: set the objective and describe the model
+	:param solver: Solver holding the variables and constraints
+	:param group: Group variables (Y)
+	:param num_group: Number of group variables
+	:param num_compat_var: Number of compatibility variables
+	:param timings: Receives variable_creation and constraint_generation durations in seconds
+	:param start: time.perf_counter() value when the build started
+	:param variables_created: time.perf_counter() value once the variables were created
+	:return: Model size (var_count)
+	"""
+	num_constraints = solver.NumConstraints()
+	set_objective(solver, group)
+	if timings is not None:
+		timings['variable_creation'] = variables_created - start
+		timings['constraint_generation'] = time.perf_counter() - variables_created
+	return {
+		'num_group': num_group,
+		'num_compat_var': num_compat_var,
+		'num_constraints': num_constraints
+	}
+
+
+def build_loop_model(solver: pywraplp.Solver, data: Dict, timings: Optional[Dict] = None) -> Tuple[Dict, List, Dict]:
+	"""
+	Reference model construction, one Python expression per constraint
+	:param solver: Solver receiving the model
+	:param data: Data matrix
+	:param timings: Receives variable_creation and constraint_generation durations in seconds
+	:return: Group variables, compatibility variables and model size
+	"""
+	start = time.perf_counter()
+	group, comp_var, num_group, num_compat_var = create_variables(solver, data['num_product'])
+	variables_created = time.perf_counter()
+
+	# Contraintes de choix de groupe
+	# Assure qu'un produit n'est attribué qu'a un seul groupe
+	for i in range(data['num_product']):
+		constraint_expr = \
+			[data['comp_matrix'][i][j] * comp_var[i][j] for j in range(data['num_product'])]
+		solver.Add(sum(constraint_expr) == 1)
+
+	# Contraintes d'incompatibilite
+	# Assure que deux produits icompatibles ne sont pas associés au même groupe.
+	for i in range(data['num_product']):
+		for j in range(data['num_product']):
+			for k in range(data['num_product']):
+				if (data['comp_matrix'][i][k] == 1 and data['comp_matrix'][j][k] == 1 and data['comp_matrix'][i][
+					j] == 0):
+					solver.Add(comp_var[i][k] + comp_var[j][k] <= 1)
+
+	# Contraintes pour la création d'un groupe
+	# Quand on associe un produit à un nouveau groupe dans la matrice X, crée le groupe dans la matrice Y (0->1)
+	for i in range(data['num_product']):
+		constraint_expr = [data['comp_matrix'][j][i] * comp_var[j][i] for j in range(data['num_product'])]
+		solver.Add(sum(constraint_expr) <= data['num_product'] * group[i])
+
+	var_count = finish_model(solver, group, num_group, num_compat_var, timings, start, variables_created)
+	return group, comp_var, var_count
+
+
+def incompatible_triples(comp_matrix: np.ndarray) -> np.ndarray:
+	"""
+	Find every (i, j, k) such that i and j are both allowed in group k while i is incompatible with j
+	:param comp_matrix: Compatibility matrix
+	:return: Array of shape (m, 3), in the same order as the reference triple loop
+	"""
+	allowed = np.asarray(comp_matrix) == 1
+	num_product = allowed.shape[0]
+	triples = [np.empty((0, 3), dtype=np.intp)]
+	for i in range(num_product):
+		# mask[j, k] = allowed[i, k] & allowed[j, k] & ~allowed[i, j]
+		mask = allowed[i][np.newaxis, :] & allowed & ~allowed[i][:, np.newaxis]
+		j, k = np.nonzero(mask)
+		triples.append(np.column_stack((np.full(len(j), i, dtype=np.intp), j, k)))
+	return np.concatenate(triples)
+
+
+def load_model(solver: pywraplp.Solver, model: linear_solver_pb2.MPModelProto) -> Optional[List]:
+	"""
+	Load a whole model into an empty solver in a single call
+	:param solver: Empty solver
+	:param model: Model to load
+	:return: Variables of the solver in creation order, None when the model was refused (the solver is then cleared)
+	"""
+	if solver.LoadModelFromProto(model):
+		# An error message, the solver may hold part of the model
+		solver.Clear()
+		return None
+	return solver.variables()
+
+
+def build_vectorized_model(solver: pywraplp.Solver, data: Dict, timings: Optional[Dict] = None) -> Tuple[Dict, List, Dict]:
+	"""
+	Same model as build_loop_model, with constraint supports computed by NumPy and written into an
+	MPModelProto, loaded in one call instead of one solver call per variable and coefficient
+	:param solver: Empty solver receiving the model
+	:param data: Data matrix
+	:param timings: Receives variable_creation and constraint_generation durations in seconds
+	:return: Group variables, compatibility variables and model size
+	"""
+	num_product = data['num_product']
+	matrix = np.asarray(data['comp_matrix']).reshape(num_product, num_product)
+	infinity = float('inf')
+	start = time.perf_counter()
+	model = linear_solver_pb2.MPModelProto()
+	# Same variables and order as create_variables: Y then X row by row, X[i][k] being at num_product * (i + 1) + k
+	for i in range(num_product):
+		model.variable.add(lower_bound=0, upper_bound=1, is_integer=True, name='group[%d]' % i)
+	for i in range(num_product):
+		for j in range(num_product):
+			model.variable.add(lower_bound=0, upper_bound=1, is_integer=True,
+			                   name="comp_var[{0}][{1}]".format(i, j))
+	x_index = np.arange(num_product * num_product).reshape(num_product, num_product) + num_product
+	variables_created = time.perf_counter()
+
+	# Contraintes de choix de groupe
+	for i in range(num_product):
+		support = np.flatnonzero(matrix[i])
+		model.constraint.add(lower_bound=1, upper_bound=1, var_index=x_index[i, support].tolist(),
+		                     coefficient=matrix[i, support].astype(float).tolist())
+
+	# Contraintes d'incompatibilite
+	triples = incompatible_triples(matrix)
+	first = x_index[triples[:, 0], triples[:, 2]].tolist()
+	second = x_index[triples[:, 1], triples[:, 2]].tolist()
+	for a, b in zip(first, second):
+		if a == b:
+			# i == j only happens with a 0 on the diagonal, the reference model then reads 2 * X[i][k] <= 1
+			model.constraint.add(lower_bound=-infinity, upper_bound=1, var_index=[a], coefficient=[2])
+		else:
+			model.constraint.add(lower_bound=-infinity, upper_bound=1, var_index=[a, b], coefficient=[1, 1])
+
+	# Contraintes pour la création d'un groupe
+	for i in range(num_product):
+		support = np.flatnonzero(matrix[:, i])
+		model.constraint.add(lower_bound=-infinity, upper_bound=0, var_index=x_index[support, i].tolist() + [i],
+		                     coefficient=matrix[support, i].astype(float).tolist() + [-num_product])
+
+	variables = load_model(solver, model)
+	if variables is None:
+		raise RuntimeError("The solver refused the vectorized model")
+	group = {i: variables[i] for i in range(num_product)}
+	comp_var = [variables[num_product * (i + 1):num_product * (i + 2)] for i in range(num_product)]
+	var_count = finish_model(solver, group, num_product, num_product * num_product, timings, start, variables_created)
+	return group, comp_var, var_count
+
+
+def incompatible_pairs(comp_matrix: np.ndarray) -> np.ndarray:
+	"""
+	Find every (i, j, k) with i < j, i and j both allowed in group k and i, j incompatible in either direction
+	:param comp_matrix: Compatibility matrix
+	:return: Array of shape (m, 3), each unordered pair listed once per group
+	"""
+	allowed = np.asarray(comp_matrix) == 1
+	incompatible = ~(allowed & allowed.T)
+	num_product = allowed.shape[0]
+	triples = [np.empty((0, 3), dtype=np.intp)]
+	for i in range(num_product - 1):
+		# mask[j, k] = allowed[i, k] & allowed[j, k] & incompatible[i, j], for j > i
+		mask = allowed[i][np.newaxis, :] & allowed[i + 1:] & incompatible[i, i + 1:][:, np.newaxis]
+		j, k = np.nonzero(mask)
+		triples.append(np.column_stack((np.full(len(j), i, dtype=np.intp), j + i + 1, k)))
+	return np.concatenate(triples)
+
+
+def create_sparse_variables(solver: pywraplp.Solver, allowed: np.ndarray) -> Tuple[Dict, Dict, int, int]:
+	"""
+	Create group variables and comp_var[i, k] only where product i is allowed in group k
+	:param solver: Solver receiving the variables
+	:param allowed: Boolean compatibility matrix
+	:return: Group variables, compatibility variables keyed by (product, group) and their counts
+	"""
+	num_product = allowed.shape[0]
+	group = {}
+	for i in range(num_product):
+		group[i] = solver.IntVar(0, 1, 'group[%d]' % i)
+	num_group = solver.NumVariables()
+
+	comp_var = {}
+	for i, k in np.argwhere(allowed).tolist():
+		comp_var[i, k] = solver.IntVar(0, 1, "comp_var[{0}][{1}]".format(i, k))
+	num_compat_var = solver.NumVariables() - num_product
+	return group, comp_var, num_group, num_compat_var
+
+
+def add_choice_constraints(solver: pywraplp.Solver, allowed: np.ndarray, comp_var: Dict) -> None:
+	"""
+	Contraintes de choix de groupe : each product joins exactly one of its allowed groups
+	:param solver: Solver holding the model
+	:param allowed: Boolean compatibility matrix
+	:param comp_var: Compatibility variables keyed by (product, group)
+	"""
+	for i in range(allowed.shape[0]):
+		constraint = solver.Constraint(1, 1)
+		for k in np.flatnonzero(allowed[i]).tolist():
+			constraint.SetCoefficient(comp_var[i, k], 1)
+
+
+def add_opening_constraints(solver: pywraplp.Solver, allowed: np.ndarray, group: Dict, comp_var: Dict) -> None:
+	"""
+	Contraintes pour la création d'un groupe, bornées par le nombre de produits admis dans le groupe
+	:param solver: Solver holding the model
+	:param allowed: Boolean compatibility matrix
+	:param group: Group variables (Y)
+	:param comp_var: Compatibility variables keyed by (product, group)
+	"""
+	for k in range(allowed.shape[0]):
+		members = np.flatnonzero(allowed[:, k]).tolist()
+		constraint = solver.Constraint(-solver.infinity(), 0)
+		for j in members:
+			constraint.SetCoefficient(comp_var[j, k], 1)
+		constraint.SetCoefficient(group[k], -len(members))
+
+
+def build_sparse_model(solver: pywraplp.Solver, data: Dict, timings: Optional[Dict] = None) -> Tuple[Dict, Dict, Dict]:
+	"""
+	Create comp_var[i, k] only where product i is allowed in group k,
+	each incompatible pair being constrained once per shared group
+	:param solver: Solver receiving the model
+	:param data: Data matrix
+	:param timings: Receives variable_creation and constraint_generation durations in seconds
+	:return: Group variables, compatibility variables keyed by (product, group) and model size
+	"""
+	num_product = data['num_product']
+	allowed = np.asarray(data['comp_matrix']).reshape(num_product, num_product) == 1
+	infinity = solver.infinity()
+
+	start = time.perf_counter()
+	group, comp_var, num_group, num_compat_var = create_sparse_variables(solver, allowed)
+	variables_created = time.perf_counter()
+
+	add_choice_constraints(solver, allowed, comp_var)
+
+	# Contraintes d'incompatibilite
+	for i, j, k in incompatible_pairs(allowed).tolist():
+		constraint = solver.Constraint(-infinity, 1)
+		constraint.SetCoefficient(comp_var[i, k], 1)
+		constraint.SetCoefficient(comp_var[j, k], 1)
+
+	add_opening_constraints(solver, allowed, group, comp_var)
+
+	var_count = finish_model(solver, group, num_group, num_compat_var, timings, start, variables_created)
+	return group, comp_var, var_count
+
+
+def build_clique_model(solver: pywraplp.Solver, data: Dict, timings: Optional[Dict] = None) -> Tuple[Dict, Dict, Dict]:
+	"""
+	Sparse model whose incompatibilities are aggregated over cliques of the incompatibility graph:
+	sum(X[i][k] for i in clique) <= Y[k], one row per clique and group instead of one per pair,
+	with a much tighter linear relaxation
+	:param solver: Solver receiving the model
+	:param data: Data matrix, its 'cliques' (see CompatibilityCatalog.selection_cliques) are used when present
+	:param timings: Receives variable_creation and constraint_generation durations in seconds
+	:return: Group variables, compatibility variables keyed by (product, group) and model size
+	"""
+	num_product = data['num_product']
+	allowed = np.asarray(data['comp_matrix']).reshape(num_product, num_product) == 1
+	infinity = solver.infinity()
+
+	start = time.perf_counter()
+	group, comp_var, num_group, num_compat_var = create_sparse_variables(solver, allowed)
+	variables_created = time.perf_counter()
+
+	cliques = data.get('cliques')
+	if cliques is None:
+		cliques = clique_cover(incompatibility_graph(data['comp_matrix']))
+
+	add_choice_constraints(solver, allowed, comp_var)
+
+	# Contraintes d'incompatibilite : au plus un produit de chaque clique par groupe
+	for clique in cliques:
+		clique = np.asarray(clique, dtype=np.intp)
+		for k in np.flatnonzero(allowed[clique].sum(axis=0) > 1).tolist():
+			constraint = solver.Constraint(-infinity, 0)
+			for i in clique[allowed[clique, k]].tolist():
+				constraint.SetCoefficient(comp_var[i, k], 1)
+			constraint.SetCoefficient(group[k], -1)
+
+	add_opening_constraints(solver, allowed, group, comp_var)
+
+	var_count = finish_model(solver, group, num_group, num_compat_var, timings, start, variables_created)
+	return group, comp_var, var_count
+
+
+def build_representative_model(solver: pywraplp.Solver, data: Dict,
+                               timings: Optional[Dict] = None) -> Tuple[Dict, Dict, Dict]:
+	"""
+	Symmetry-free model: every group is represented by its smallest product, so a product may only join
+	the group of a compatible product placed before it, and opens its own group by joining it.
+	Each grouping then has a single encoding, group 0 is always opened and SCIP stops exploring
+	relabelled copies of the same solution.
+	Falls back to build_sparse_model when a product is refused in its own group, as it cannot represent one.
+	:param solver: Solver receiving the model
+	:param data: Data matrix
+	:param timings: Receives variable_creation and constraint_generation durations in seconds
+	:return: Group variables, compatibility variables keyed by (product, group) and model size
+	"""
+	num_product = data['num_product']
+	allowed = np.asarray(data['comp_matrix']).reshape(num_product, num_product) == 1
+	if not accepts_own_groups(allowed):
+		return build_sparse_model(solver, data, timings)
+	compatible = allowed & allowed.T
+	# candidates[i, k]: product i may join the group represented by k
+	candidates = np.tril(compatible)
+	infinity = solver.infinity()
+
+	start = time.perf_counter()
+	group, comp_var, num_group, num_compat_var = create_sparse_variables(solver, candidates)
+	variables_created = time.perf_counter()
+
+	add_choice_constraints(solver, candidates, comp_var)
+
+	# Un groupe est ouvert exactement quand son représentant y est
+	for k in range(num_product):
+		constraint = solver.Constraint(0, 0)
+		constraint.SetCoefficient(comp_var[k, k], 1)
+		constraint.SetCoefficient(group[k], -1)
+
+	# Contraintes d'incompatibilite entre deux candidats d'un même groupe : X[i][k] + X[j][k] <= Y[k]
+	for k in range(num_product):
+		members = np.flatnonzero(candidates[:, k])
+		for a, b in np.argwhere(np.triu(~compatible[np.ix_(members, members)], 1)).tolist():
+			constraint = solver.Constraint(-infinity, 0)
+			constraint.SetCoefficient(comp_var[int(members[a]), k], 1)
+			constraint.SetCoefficient(comp_var[int(members[b]), k], 1)
+			constraint.SetCoefficient(group[k], -1)
+
+	add_opening_constraints(solver, candidates, group, comp_var)
+
+	var_count = finish_model(solver, group, num_group, num_compat_var, timings, start, variables_created)
+	return group, comp_var, var_count
+
+
+def build_lazy_model(solver: pywraplp.Solver, data: Dict, timings: Optional[Dict] = None) -> Tuple[Dict, Dict, Dict]:
+	"""
+	Sparse model without any incompatibility constraint, they are added by separate_incompatibilities
+	only for the pairs that the incumbent puts together
+	:param solver: Solver receiving the model
+	:param data: Data matrix
+	:param timings: Receives variable_creation and constraint_generation durations in seconds
+	:return: Group variables, compatibility variables keyed by (product, group) and model size
+	"""
+	num_product = data['num_product']
+	allowed = np.asarray(data['comp_matrix']).reshape(num_product, num_product) == 1
+
+	start = time.perf_counter()
+	group, comp_var, num_group, num_compat_var = create_sparse_variables(solver, allowed)
+	variables_created = time.perf_counter()
+
+	add_choice_constraints(solver, allowed, comp_var)
+	add_opening_constraints(solver, allowed, group, comp_var)
+
+	var_count = finish_model(solver, group, num_group, num_compat_var, timings, start, variables_created)
+	return group, comp_var, var_count
+
+
+def separate_incompatibilities(solver: pywraplp.Solver, data: Dict, comp_var: Dict,
+                               pair_product_group_list: List) -> int:
+	"""
+	Find the incompatible pairs sharing a group in the last solution of a lazy model and forbid them
+	to share any group, the solver can then be solved again
+	:param solver: Solver holding a model built by build_lazy_model
+	:param data: Data matrix
+	:param comp_var: Compatibility variables keyed by (product, group)
+	:param pair_product_group_list: Last solution, read before the cuts invalidate it
+	:return: Number of constraints added, 0 when the solution is feasible for the full model
+	"""
+	num_product = data['num_product']
+	allowed = np.asarray(data['comp_matrix']).reshape(num_product, num_product) == 1
+	incompatible = ~(allowed & allowed.T)
+	members = {}
+	for i, label in pair_product_group_list:
+		members.setdefault(label, []).append(i)
+
+	infinity = solver.infinity()
+	num_cuts = 0
+	for products in members.values():
+		for a, b in np.argwhere(np.triu(incompatible[np.ix_(products, products)], 1)).tolist():
+			i, j = products[a], products[b]
+			# The pair would otherwise just move to another shared group in the next round
+			for k in np.flatnonzero(allowed[i] & allowed[j]).tolist():
+				constraint = solver.Constraint(-infinity, 1)
+				constraint.SetCoefficient(comp_var[i, k], 1)
+				constraint.SetCoefficient(comp_var[j, k], 1)
+				num_cuts += 1
+	return num_cuts
+
+
+def add_group_bounds(solver: pywraplp.Solver, group: Dict, lower_bound: int, upper_bound: int) -> None:
+	"""
+	Restrict the number of opened groups to bounds proven beforehand
+	:param solver: Solver holding the model
+	:param group: Group variables (Y)
+	:param lower_bound: Minimum number of groups
+	:param upper_bound: Maximum number of groups
+	"""
+	constraint = solver.Constraint(lower_bound, upper_bound)
+	for k in range(len(group)):
+		constraint.SetCoefficient(group[k], 1)
+
+
+def iter_comp_var(comp_var):
+	"""
+	Iterate over compatibility variables whatever the builder layout
+	:param comp_var: Nested lists (dense builders) or dict keyed by (product, group) (sparse builder)
+	:return: Generator of (product, group, variable)
+	"""
+	if isinstance(comp_var, dict):
+		for (i, k), var in comp_var.items():
+			yield i, k, var
+	else:
+		for i, row in enumerate(comp_var):
+			for k, var in enumerate(row):
+				yield i, k, var
+
+
+def comp_var_keys(comp_var) -> np.ndarray:
+	"""
+	(product, group) of every compatibility variable, in creation order
+	:param comp_var: Nested lists (dense builders) or dict keyed by (product, group) (sparse builder)
+	:return: Array of shape (number of variables, 2)
+	"""
+	if isinstance(comp_var, dict):
+		return np.array(list(comp_var), dtype=np.intp).reshape(-1, 2)
+	num_product = len(comp_var)
+	return np.column_stack(np.divmod(np.arange(num_product * num_product), num_product))
+
+
+MODEL_BUILDERS = {
+	'loop': build_loop_model,
+	'vectorized': build_vectorized_model,
+	'sparse': build_sparse_model,
+	'lazy': build_lazy_model,
+	'clique': build_clique_model,
+	'representative': build_representative_model,
+}
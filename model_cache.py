@@ -0,0 +1,155 @@
+from ortools.linear_solver import linear_solver_pb2, pywraplp
+import json
+import sqlite3
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from decomposition import sub_data_model
+from model_builder import load_model
+from result_cache import canonical_order, matrix_hash
+
+
+def canonical_data(data: Dict) -> Tuple[Dict, List[int]]:
+	"""
+	Reorder a data matrix by product name, so that permutations of a selection share one model
+	:param data: Data matrix
+	:return: Reordered data matrix and the original index of each of its products
+	"""
+	order = canonical_order(data['name_product'])
+	if order == list(range(data['num_product'])):
+		return data, order
+	canonical = sub_data_model(data, order)
+	if 'cliques' in data:
+		position = {i: p for p, i in enumerate(order)}
+		canonical['cliques'] = [sorted(position[i] for i in clique) for clique in data['cliques']]
+	return canonical, order
+
+
+def model_key(builder: str, data: Dict) -> str:
+	"""
+	:param builder: Model construction engine
+	:param data: Data matrix in canonical order
+	:return: Cache key of its model
+	"""
+	matrix = np.asarray(data['comp_matrix']).reshape(data['num_product'], data['num_product'])
+	return '{0}:{1}'.format(builder, matrix_hash(matrix, list(data['name_product'])))
+
+
+def _entry_size(entry: Tuple) -> int:
+	return len(entry[0]) + len(entry[1])
+
+
+class ModelCache:
+	"""
+	Models already built, stored as serialized MPModelProto with the (product, group) of their
+	compatibility variables: a selection is built once in Python, its later solves load the model
+	in a single LoadModelFromProto call. Bounds, hints and lazy cuts are added by each solve and never stored.
+	In memory, a model is only stored when its selection is built a second time, one-off selections do not pay
+	the export. With a file every build is stored, as each CLI call is a new process that remembers no miss.
+	An in-memory LRU sits in front of an optional SQLite file, both bounded by the total size of their models,
+	the least recently used models being evicted first.
+	"""
+	def __init__(self, path: Optional[str] = None, max_memory_bytes: int = 64 * 2 ** 20,
+	             max_disk_bytes: int = 256 * 2 ** 20, max_missed: int = 1024):
+		"""
+		:param path: SQLite file of the on-disk tier, None to keep models in memory only
+		:param max_memory_bytes: Total size of the models kept in memory
+		:param max_disk_bytes: Total size of the models kept on disk
+		:param max_missed: Number of selections remembered as built once
+		"""
+		self.path = path
+		self.max_memory_bytes = max_memory_bytes
+		self.max_disk_bytes = max_disk_bytes
+		self.max_missed = max_missed
+		self.memory = OrderedDict()
+		self.memory_bytes = 0
+		self.missed = OrderedDict()
+		self.lock = threading.Lock()
+		self.connection = None
+		if path is not None:
+			self.connection = sqlite3.connect(path, check_same_thread=False)
+			self.connection.execute("CREATE TABLE IF NOT EXISTS models (key TEXT PRIMARY KEY, model BLOB, keys BLOB, "
+			                        "var_count TEXT, size INTEGER, accessed REAL)")
+			self.connection.commit()
+
+	def load(self, key: str, solver: pywraplp.Solver) -> Optional[Tuple[Dict, Dict, Dict]]:
+		"""
+		Load a stored model into an empty solver
+		:param key: model_key of the selection
+		:param solver: Empty solver
+		:return: Group variables, compatibility variables keyed by (product, group) and model size, None on a miss
+		"""
+		with self.lock:
+			entry = self.memory.get(key)
+			if entry is not None:
+				self.memory.move_to_end(key)
+			elif self.connection is not None:
+				row = self.connection.execute("SELECT model, keys, var_count FROM models WHERE key = ?", (key,)).fetchone()
+				if row is not None:
+					entry = (bytes(row[0]), bytes(row[1]), json.loads(row[2]))
+					self.connection.execute("UPDATE models SET accessed = ? WHERE key = ?", (time.time(), key))
+					self.connection.commit()
+					self._remember(key, entry)
+			if entry is None:
+				self.missed[key] = self.missed.pop(key, 0) + 1
+				while len(self.missed) > self.max_missed:
+					self.missed.popitem(last=False)
+		if entry is None:
+			return None
+		model, keys, var_count = entry
+		variables = load_model(solver, linear_solver_pb2.MPModelProto.FromString(model))
+		if variables is None:
+			return None
+		keys = np.frombuffer(keys, dtype=np.int32).reshape(-1, 2).tolist()
+		num_group = len(variables) - len(keys)
+		group = {k: variables[k] for k in range(num_group)}
+		comp_var = dict(zip((tuple(key) for key in keys), variables[num_group:]))
+		return group, comp_var, dict(var_count)
+
+	def store(self, key: str, solver: pywraplp.Solver, keys: np.ndarray, var_count: Dict) -> bool:
+		"""
+		Store the model a builder just created, before any bound or hint is added, when the cache has a file
+		or its selection already missed the cache before
+		:param key: model_key of the selection
+		:param solver: Solver holding the model
+		:param keys: comp_var_keys of its compatibility variables
+		:param var_count: Model size
+		:return: Whether the model was stored
+		"""
+		with self.lock:
+			if self.connection is None and self.missed.get(key, 0) < 2:
+				return False
+			self.missed.pop(key, None)
+		model = linear_solver_pb2.MPModelProto()
+		solver.ExportModelToProto(model)
+		entry = (model.SerializeToString(), np.asarray(keys, dtype=np.int32).tobytes(), dict(var_count))
+		with self.lock:
+			self._remember(key, entry)
+			if self.connection is not None:
+				self.connection.execute("INSERT OR REPLACE INTO models VALUES (?, ?, ?, ?, ?, ?)",
+				                        (key, entry[0], entry[1], json.dumps(entry[2]), _entry_size(entry),
+				                         time.time()))
+				self.connection.execute("DELETE FROM models WHERE key IN (SELECT key FROM (SELECT key, SUM(size) OVER "
+				                        "(ORDER BY accessed DESC) AS total FROM models) WHERE total > ?)",
+				                        (self.max_disk_bytes,))
+				self.connection.commit()
+		return True
+
+	def _remember(self, key: str, entry: Tuple) -> None:
+		if key in self.memory:
+			self.memory_bytes -= _entry_size(self.memory.pop(key))
+		self.memory[key] = entry
+		self.memory_bytes += _entry_size(entry)
+		while self.memory_bytes > self.max_memory_bytes:
+			_, evicted = self.memory.popitem(last=False)
+			self.memory_bytes -= _entry_size(evicted)
+
+	def __getstate__(self) -> Dict:
+		# A copy sent to a worker process opens its own connection to the same file
+		return {'path': self.path, 'max_memory_bytes': self.max_memory_bytes, 'max_disk_bytes': self.max_disk_bytes,
+		        'max_missed': self.max_missed}
+
+	def __setstate__(self, state: Dict) -> None:
+		self.__init__(state['path'], state['max_memory_bytes'], state['max_disk_bytes'], state['max_missed'])
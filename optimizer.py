@@ -1,20 +1,66 @@
-from ortools.linear_solver import pywraplp
-import pandas as pd
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional
 import argparse
+import backends
+from backends import BACKENDS, create_backend
+from catalog import CompatibilityCatalog, UnknownProductsError
+from model_builder import MODEL_BUILDERS
+from presolve import presolve, proven_var_count
+from reduction import expand_grouping, reduce_data
+from decomposition import solve_decomposed
+from grouping import Grouping
+from metrics import JsonLinesHook, MetricsHook, SolveMetrics, emit
+from model_cache import ModelCache
+from result_cache import ResultCache, default_cache_path
+from service import DEFAULT_PORT, ServiceClient, serve
 
 class ProductOptimizer:
 	"""
 	Add Doc Here
 	"""
-	def __init__(self, retention_csv: str):
+	def __init__(self, retention_csv: str, builder: str = 'vectorized', use_presolve: bool = True,
+	             backend: str = 'scip', num_search_workers: int = 8, decompose: bool = False,
+	             max_workers: Optional[int] = None, cache_path: Optional[str] = None, cache_size: int = 256,
+	             metrics_hook: Optional[MetricsHook] = None, use_reduction: bool = True,
+	             model_cache_path: Optional[str] = None, model_cache_size: int = 0):
 		"""
 		Read data from csv path
-		:param retention_csv: Path to csv containing data
+		:param retention_csv: Path to csv containing data, or to its binary conversion (see catalog.py)
+		:param builder: Model construction engine, one of MODEL_BUILDERS
+		:param use_presolve: Try to prove the grouping with coloring and clique bounds before creating a solver
+		:param backend: Solving backend, one of BACKENDS
+		:param num_search_workers: Number of parallel workers for the CP-SAT backend
+		:param decompose: Solve each component of the incompatibility graph separately
+		:param max_workers: Number of processes solving components in parallel
+		:param cache_path: SQLite file keeping solved selections across runs, None for the file next to the catalog
+		                   (see default_cache_path), '' for an in-memory cache only
+		:param cache_size: Number of selections kept in memory, 0 disables the cache
+		:param metrics_hook: Called with the SolveMetrics of every run, e.g. a metrics.JsonLinesHook
+		:param use_reduction: Remove products that can always follow another one before building the model
+		:param model_cache_path: SQLite file keeping the built SCIP models across runs
+		:param model_cache_size: Megabytes of built models kept in memory, the model cache is off when it is 0
+		                         and no model_cache_path is given
 		"""
 		self.retention_csv = retention_csv
-		self.data_df = pd.read_csv(retention_csv, sep=",")
-		self.solver = pywraplp.Solver.CreateSolver('SCIP')
+		self.catalog = CompatibilityCatalog.load(retention_csv)
+		self.backend_name = backend
+		self.builder = builder
+		self.metrics_hook = metrics_hook
+		self.last_metrics = None
+		self.solver = None
+		model_cache = None
+		if model_cache_size > 0 or model_cache_path is not None:
+			model_cache = ModelCache(model_cache_path, max_memory_bytes=model_cache_size * 2 ** 20)
+		self.backend = create_backend(backend, builder=builder, num_search_workers=num_search_workers,
+		                              model_cache=model_cache)
+		self.use_presolve = use_presolve
+		self.use_reduction = use_reduction
+		self.decompose = decompose
+		self.max_workers = max_workers
+		self.cache = None
+		if cache_size > 0:
+			if cache_path is None:
+				cache_path = default_cache_path(retention_csv)
+			self.cache = ResultCache(self.catalog.fingerprint(), path=cache_path or None, max_entries=cache_size)
 
 	def create_data_model(self, list_name: List) -> Dict:
 		"""
@@ -32,19 +78,7 @@ class ProductOptimizer:
 		:param list_name: List of products to extract
 		:return: List of found products
 		"""
-		list_index = []
-		for name in list_name:
-			index = 0
-			found_product = False
-			for i, prod in enumerate(self.data_df.columns.to_list()):
-				if self.data_df.columns.to_list()[i] == name:
-					index = i
-					found_product = True
-			if not found_product:
-				print("Wrong product name - {0} - Problem might not be solvable \n".format(name))
-			else:
-				list_index.append(index)
-		return list_index
+		return self.catalog.get_product_list(list_name)
 
 	def create_data_matrix(self, product_list: List, list_name: List) -> Dict:
 		"""
@@ -53,22 +87,8 @@ class ProductOptimizer:
 		:param list_name: List of products to use
 		:return: Matrix contraining all data needed for computation
 		"""
-		matrix = []
-		# TODO: Replace double for loop
-		for i in range(len(product_list)):
-			matrix.append([])
-			for j in range(len(product_list)):
-				matrix[i].append(self.data_df.values[product_list[i]][product_list[j]])
-
-		data = {
-			"comp_matrix": matrix,
-			"num_product": len(matrix),
-			'name_product': list_name
-		}
-		# Si aucun nom, on met juste des numéros de produits
-		if len(data['name_product']) == 0:
-			data['name_product'] = range(data['num_product'])
-		return data
+		# The clique builder reuses the catalog's clique cover instead of enumerating cliques per request
+		return self.catalog.create_data_matrix(product_list, list_name, with_cliques=self.builder == 'clique')
 
 	@staticmethod
 	def verify_data_model(data: Dict) -> bool:
@@ -92,130 +112,216 @@ class ProductOptimizer:
 			print("WRONG INPUT: problem will not be solved.\n")
 		return right_input
 
-	@staticmethod
-	def process_result(status, data, comp_var, group) -> List:
+	process_result = staticmethod(backends.process_result)
+
+	def solve_data_model(self, data: Dict, time_limit: Optional[float] = None, relative_gap: Optional[float] = None,
+	                     progress: Optional[Callable] = None, metrics: Optional[SolveMetrics] = None):
 		"""
-		Resolve optimization problem
-		:param status: Solver Status
+		Group the products of a verified data matrix
 		:param data: Data matrix
-		:param comp_var: Matrice X
-		:param group: Matrice Y
-		:return: Liste des groupes avec les produits associés
-		"""
-		pair_product_group_list = None
-		if status == pywraplp.Solver.OPTIMAL:
-			min_index_group = 0
-			for i in range(data['num_product']):
-				if group[i].solution_value() == 1:
-					min_index_group = i
-					break
-			pair_product_group_list = []
-			for i in range(data['num_product']):
-				for j in range(data['num_product']):
-					if comp_var[i][j].solution_value() == 1:
-						pair_product_group_list.append([i, j - min_index_group])
-		return pair_product_group_list
-
-	def run_simulation(self, list_name):
+		:param time_limit: Seconds after which the best incumbent is returned
+		:param relative_gap: Relative gap at which the search stops
+		:param progress: Called with (objective, best_bound, seconds) on improving solutions
+		:param metrics: Receives the presolve, build, solve and extraction times
+		:return: Solver (None when no solver was needed), pair_product_group_list and var_count
 		"""
-		Run Main
-		:param list_name: List of products to use
-		:return:
-		"""
-		data = self.create_data_model(list_name)
-		assert self.verify_data_model(data)
+		metrics = metrics if metrics is not None else SolveMetrics(self.backend_name)
+		if self.decompose:
+			# Components are solved in other processes, only the whole decomposed solve is timed
+			with metrics.phase('solve'):
+				pair_product_group_list, var_count = solve_decomposed(data, self.backend, self.use_presolve,
+				                                                      self.max_workers, time_limit, relative_gap)
+			return None, pair_product_group_list, var_count
 
-		#########################
-		# Creation des matrices #
-		#########################
+		reduction = None
+		if self.use_reduction:
+			with metrics.phase('presolve'):
+				reduction = reduce_data(data)
+		if reduction is None:
+			return self._solve_reduced(data, time_limit, relative_gap, progress, metrics)
+		solver, pair_product_group_list, var_count = self._solve_reduced(reduction['data'], time_limit, relative_gap,
+		                                                                 progress, metrics)
+		if pair_product_group_list is not None:
+			pair_product_group_list = expand_grouping(reduction, pair_product_group_list, data['num_product'])
+		return solver, pair_product_group_list, var_count
 
-		# Creating group variables, with 0 product each (Y)
-		# Crée la matrice Y avec une colonne par produit (liste), remplie de 0
-		group = {}
-		for i in range(data['num_product']):
-			group[i] = self.solver.IntVar(0, 1, 'group[%d]' % i)
-		num_group = self.solver.NumVariables()
+	def _solve_reduced(self, data: Dict, time_limit: Optional[float], relative_gap: Optional[float],
+	                   progress: Optional[Callable], metrics: SolveMetrics):
+		bounds = None
+		if self.use_presolve:
+			with metrics.phase('presolve'):
+				bounds = presolve(data)
+			if bounds['pair_product_group_list'] is not None:
+				return None, bounds['pair_product_group_list'], proven_var_count(bounds['upper_bound'])
+			if progress is not None:
+				progress(bounds['upper_bound'], bounds['lower_bound'], 0.0)
 
-		# Creating compatibility variables (X)
-		# Crée la matrice X, avec une ligne par produit et une colone par groupe, remplie de 0
-		comp_var = []
-		for i in range(data['num_product']):
-			comp_var.append([])
-			for j in range(data['num_product']):
-				comp_var[i].append(self.solver.IntVar(0, 1, "comp_var[{0}][{1}]".format(i, j)))
-		num_compat_var = self.solver.NumVariables() - data['num_product']
+		#################
+		# Solve problem #
+		#################
 
-		############################
-		# Creation des contraintes #
-		############################
+		solver, pair_product_group_list, var_count = self.backend.solve(data, bounds, time_limit=time_limit,
+		                                                                relative_gap=relative_gap, progress=progress,
+		                                                                metrics=metrics)
+		return solver, pair_product_group_list, var_count
 
-		# Contraintes de choix de groupe
-		# Assure qu'un produit n'est attribué qu'a un seul groupe
-		for i in range(data['num_product']):
-			constraint_expr = \
-				[data['comp_matrix'][i][j] * comp_var[i][j] for j in range(data['num_product'])]
-			self.solver.Add(sum(constraint_expr) == 1)
+	def run_simulation(self, list_name, time_limit: Optional[float] = None, relative_gap: Optional[float] = None,
+	                   progress: Optional[Callable] = None, metrics: Optional[SolveMetrics] = None):
+		"""
+		Run Main
+		:param list_name: List of products to use
+		:param time_limit: Seconds after which the best incumbent is returned (status FEASIBLE in var_count)
+		:param relative_gap: Relative gap at which the search stops
+		:param progress: Called with (objective, best_bound, seconds) on improving solutions
+		:param metrics: Filled with the phase times and solver statistics of the run, also kept in last_metrics
+		:return: Solver, Grouping (None when no solution was found), data and var_count
+		:raise UnknownProductsError: When a product is not in the catalog
+		"""
+		unknown = self.catalog.unknown_names(list_name)
+		if unknown:
+			raise UnknownProductsError(unknown)
+		metrics = metrics if metrics is not None else SolveMetrics(self.backend_name)
+		self.last_metrics = metrics
+		self.reset()
+		with metrics.phase('load'):
+			data = self.create_data_model(list_name)
+		assert self.verify_data_model(data)
+		metrics.num_product = data['num_product']
 
-		# Contraintes d'incompatibilite
-		# Assure que deux produits icompatibles ne sont pas associés au même groupe.
-		for i in range(data['num_product']):
-			for j in range(data['num_product']):
-				for k in range(data['num_product']):
-					if (data['comp_matrix'][i][k] == 1 and data['comp_matrix'][j][k] == 1 and data['comp_matrix'][i][
-						j] == 0):
-						self.solver.Add(comp_var[i][k] + comp_var[j][k] <= 1)
-
-		# Contraintes pour la création d'un groupe
-		# Assure de ne pas associé trop de produits dans chaque groupe
-		# Quand on associe un produit à un nouveau groupe dans la matrice X, crée le groupe dans la matrice Y (0->1)
-		for i in range(data['num_product']):
-			constraint_expr = [data['comp_matrix'][j][i] * comp_var[j][i] for j in range(data['num_product'])]
-			self.solver.Add(sum(constraint_expr) <= data['num_product'] * group[i])
-
-		# Coef 1 pour chaque produit
-		num_constraints = self.solver.NumConstraints()
-		objective = self.solver.Objective()
-		for j in range(data['num_product']):
-			objective.SetCoefficient(group[j], 1)
-		objective.SetMinimization()
-
-		# Variables
-		var_count = {
-			'num_group': num_group,
-			'num_compat_var': num_compat_var,
-			'num_constraints': num_constraints
-		}
+		if self.cache is not None:
+			with metrics.phase('lookup'):
+				cached = self.cache.get(data['name_product'])
+			if cached is not None:
+				pair_product_group_list, var_count = cached
+				metrics.cache_hit = True
+				metrics.record_solution(var_count)
+				emit(metrics, self.metrics_hook)
+				grouping = Grouping.from_pairs(pair_product_group_list, data['num_product'], var_count['status'])
+				return None, grouping, data, var_count
 
-		#################
-		# Solve problem #
-		#################
+		solver, pair_product_group_list, var_count = self.solve_data_model(data, time_limit, relative_gap, progress,
+		                                                                   metrics)
+		self.solver = solver
+		# Only proven groupings are worth replaying
+		if self.cache is not None and pair_product_group_list is not None and var_count['status'] == 'OPTIMAL':
+			self.cache.put(data['name_product'], pair_product_group_list, var_count)
+		metrics.record_solution(var_count)
+		emit(metrics, self.metrics_hook)
+		grouping = None
+		if pair_product_group_list is not None:
+			grouping = Grouping.from_pairs(pair_product_group_list, data['num_product'], var_count['status'])
+		return solver, grouping, data, var_count
 
-		status = self.solver.Solve()
-		pair_product_group_list = self.process_result(status, data, comp_var, group)
-		pair_product_group_list = sorted(pair_product_group_list, key=lambda x: x[1])
-		return self.solver, pair_product_group_list, data, var_count
+	def reset(self) -> None:
+		"""
+		Give the solver of the last run back to the backend pool, cleared: it is only readable until the next run.
+		The catalog and its index are kept.
+		"""
+		if self.solver is not None:
+			self.backend.release(self.solver)
+			self.solver = None
 
 	@staticmethod
-	def print_group(pair_product_group_list, data):
+	def print_group(grouping: Grouping, data):
 		"""Print the group"""
 		print('\n---------------------Groups--------------------')
-		pair_product_group_list = sorted(pair_product_group_list, key=lambda x: x[1])
-		group_index = -1
-		for pair_product_group in pair_product_group_list:
-			if group_index != pair_product_group[1]:
-				group_index = pair_product_group[1]
-				print("\nGroup {0} contains : {1}".format(group_index, data['name_product'][pair_product_group[0]]))
-			else:
-				print("{0}                  {1}".format(" " * len(str(group_index)),
-				                                        data['name_product'][pair_product_group[0]]))
+		for group_index, names in enumerate(grouping.names(data['name_product'])):
+			print("\nGroup {0} contains : {1}".format(group_index, names[0]))
+			for name in names[1:]:
+				print("{0}                  {1}".format(" " * len(str(group_index)), name))
 
 if __name__== '__main__':
 	parser = argparse.ArgumentParser()
-	parser.add_argument('products', metavar='P', type=str, nargs='+',
+	parser.add_argument('products', metavar='P', type=str, nargs='*',
 	                    help='Liste des produits pour optimization')
 	parser.add_argument('-C','--csv_path', type=str, default='app/data/retention_pc.csv',
 	                    help="Chemin vers le fichier CSV contenant la matrice de compatibilité")
+	parser.add_argument('-B', '--builder', type=str, default='vectorized', choices=sorted(MODEL_BUILDERS),
+	                    help="Moteur de construction du modèle")
+	parser.add_argument('--no-presolve', dest='presolve', action='store_false',
+	                    help="Toujours résoudre le MIP, sans borne de coloration ni de clique")
+	parser.add_argument('--no-reduction', dest='reduction', action='store_false',
+	                    help="Garder les produits compatibles avec tous les autres ou dominés dans le modèle")
+	parser.add_argument('--backend', type=str, default='scip', choices=BACKENDS,
+	                    help="Solveur utilisé pour le modèle de regroupement")
+	parser.add_argument('-W', '--num_search_workers', type=int, default=8,
+	                    help="Nombre de workers parallèles pour le backend cp-sat")
+	parser.add_argument('--decompose', action='store_true',
+	                    help="Résoudre séparément chaque composante du graphe d'incompatibilité")
+	parser.add_argument('--max_workers', type=int, default=None,
+	                    help="Nombre de processus pour la résolution des composantes")
+	parser.add_argument('--cache_path', type=str, default=None,
+	                    help="Fichier SQLite conservant les résultats entre deux appels "
+	                         "(par défaut à côté du catalogue, '' pour un cache en mémoire seulement)")
+	parser.add_argument('--model_cache_path', type=str, default=None,
+	                    help="Fichier SQLite conservant les modèles construits entre deux appels")
+	parser.add_argument('--model_cache_size', type=int, default=0,
+	                    help="Taille en Mo des modèles construits gardés en mémoire (0 : pas de cache mémoire)")
+	parser.add_argument('--batch', type=str, default=None,
+	                    help="Fichier JSONL/CSV avec une liste de produits par ligne ('-' pour stdin), "
+	                         "un résultat JSON est écrit par ligne")
+	parser.add_argument('--workers', type=int, default=None,
+	                    help="Nombre de processus du mode batch")
+	parser.add_argument('--timeout', type=float, default=None,
+	                    help="Temps maximal par liste en secondes (mode batch)")
+	parser.add_argument('-T', '--time_limit', type=float, default=None,
+	                    help="Temps de résolution maximal en secondes, la meilleure solution trouvée est renvoyée")
+	parser.add_argument('-G', '--relative_gap', type=float, default=None,
+	                    help="Écart relatif à la borne à partir duquel la recherche s'arrête")
+	parser.add_argument('--serve', action='store_true',
+	                    help="Lance le démon de résolution (catalogue chargé une fois, API JSON locale)")
+	parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+	                    help="Port du démon de résolution")
+	parser.add_argument('--no-daemon', dest='daemon', action='store_false',
+	                    help="Ne pas passer par le démon même s'il tourne")
+	parser.add_argument('--metrics', type=str, default=None,
+	                    help="Fichier JSONL recevant les temps de chaque phase et les statistiques du solveur "
+	                         "('-' pour la sortie d'erreur)")
 	args = parser.parse_args()
-	po = ProductOptimizer(args.csv_path)
-	solver, pair_product_group_list, data, var_count = po.run_simulation(args.products)
-	po.print_group(pair_product_group_list, data)
+	optimizer_kwargs = {
+		'retention_csv': args.csv_path,
+		'builder': args.builder,
+		'use_presolve': args.presolve,
+		'use_reduction': args.reduction,
+		'backend': args.backend,
+		'num_search_workers': args.num_search_workers,
+		'decompose': args.decompose,
+		'max_workers': args.max_workers,
+		'cache_path': args.cache_path,
+		'model_cache_path': args.model_cache_path,
+		'model_cache_size': args.model_cache_size,
+		'metrics_hook': JsonLinesHook(args.metrics) if args.metrics is not None else None
+	}
+	if args.batch is not None:
+		import sys
+		from batch import open_jobs, run_batch
+		with open_jobs(args.batch) as stream:
+			run_batch(stream, sys.stdout, optimizer_kwargs, workers=args.workers, timeout=args.timeout,
+			          time_limit=args.time_limit, relative_gap=args.relative_gap)
+	elif args.serve:
+		serve(optimizer_kwargs, port=args.port, workers=args.workers or 4, timeout=args.timeout)
+	elif not args.products:
+		parser.error("a product list or --batch is required")
+	else:
+		client = ServiceClient('http://127.0.0.1:{0}'.format(args.port))
+		# Metrics are recorded by the process that solves, the daemon would not write them here
+		try:
+			if args.daemon and args.metrics is None and client.serves(optimizer_kwargs):
+				# The daemon already holds the catalog and warm imports
+				solver, grouping, data, var_count = client.run_simulation(
+					args.products, time_limit=args.time_limit, relative_gap=args.relative_gap)
+			else:
+				po = ProductOptimizer(**optimizer_kwargs)
+				solver, grouping, data, var_count = po.run_simulation(
+					args.products, time_limit=args.time_limit, relative_gap=args.relative_gap,
+					progress=lambda objective, bound, seconds: print(
+						"{0:.2f}s  groups = {1}  bound = {2:.2f}".format(seconds, objective, bound)))
+		except UnknownProductsError as error:
+			parser.error(str(error))
+		if grouping is None:
+			print("No grouping found within the time limit.")
+		else:
+			if var_count.get('status') == 'FEASIBLE':
+				print("Best grouping found: {0} groups, bound {1:.2f}, gap {2:.1%}".format(
+					var_count['objective'], var_count['best_bound'], var_count['gap']))
+			ProductOptimizer.print_group(grouping, data)
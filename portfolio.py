@@ -0,0 +1,189 @@
+import math
+import multiprocessing
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from backends import SolveHandle, create_backend
+from metrics import SolveMetrics
+from presolve import accepts_own_groups, coloring_to_pairs, dsatur_coloring, incompatibility_graph, solution_info, tabu_coloring
+
+STRATEGIES = ('scip', 'cp-sat', 'heuristic')
+
+
+def _heuristic(data: Dict, lower_bound, upper_bound, results, attempts: int = 20) -> None:
+	"""
+	DSATUR then TabuCol with one color less each time it succeeds, every improvement is sent with its coloring
+	"""
+	adjacency = incompatibility_graph(data['comp_matrix'])
+	coloring = dsatur_coloring(adjacency)
+	results.put(('incumbent', 'heuristic', coloring))
+	num_colors = len(set(coloring))
+	seed = 0
+	while num_colors > max(lower_bound.value, 1) and seed < attempts:
+		attempt = tabu_coloring(adjacency, num_colors - 1, coloring, seed=seed,
+		                        stop=lambda: upper_bound.value <= lower_bound.value)
+		seed += 1
+		if attempt is not None:
+			coloring = attempt
+			num_colors = len(set(coloring))
+			results.put(('incumbent', 'heuristic', coloring))
+			seed = 0
+
+
+def _race_worker(strategy: str, backend_kwargs: Dict, data: Dict, bounds: Optional[Dict], time_limit: Optional[float],
+                 relative_gap: Optional[float], lower_bound, upper_bound, results) -> None:
+	"""
+	Run one strategy, reporting its bounds as they improve and giving up once the shared bounds meet
+	"""
+	try:
+		if strategy == 'heuristic':
+			_heuristic(data, lower_bound, upper_bound, results)
+			results.put(('done', strategy, None, None))
+			return
+
+		handle = SolveHandle()
+		finished = threading.Event()
+
+		def watch():
+			# Another strategy already holds a grouping matching the best bound
+			while not finished.wait(0.05):
+				if upper_bound.value <= lower_bound.value:
+					handle.cancel()
+					return
+
+		def progress(objective, best_bound, seconds):
+			results.put(('bound', strategy, objective, best_bound))
+
+		threading.Thread(target=watch, daemon=True).start()
+		backend = create_backend(strategy, **backend_kwargs)
+		_, pair_product_group_list, var_count = backend.solve(data, bounds, time_limit=time_limit,
+		                                                      relative_gap=relative_gap, progress=progress, handle=handle)
+		finished.set()
+		results.put(('done', strategy, pair_product_group_list, var_count))
+	except Exception as error:
+		results.put(('error', strategy, '{0}: {1}'.format(type(error).__name__, error), None))
+
+
+class PortfolioBackend:
+	"""
+	Race several strategies on the same data matrix in separate processes: the SCIP assignment model,
+	the CP-SAT model and a greedy coloring improved by local search. Bounds are shared, the race stops as soon
+	as a grouping is proven optimal, by its own solver or by the best bound of another one, and the
+	remaining processes are killed.
+	"""
+	name = 'portfolio'
+
+	def __init__(self, builder: str = 'vectorized', num_search_workers: int = 8, strategies: Sequence[str] = STRATEGIES):
+		"""
+		:param builder: Model construction engine of the SCIP strategy
+		:param num_search_workers: Number of workers of the CP-SAT strategy
+		:param strategies: Strategies raced, among STRATEGIES
+		"""
+		self.builder = builder
+		self.num_search_workers = num_search_workers
+		self.strategies = tuple(strategies)
+
+	def release(self, solver) -> None:
+		"""Solvers live in the racing processes, there is nothing to give back"""
+
+	def solve(self, data: Dict, bounds: Optional[Dict] = None, hint: Optional[List[int]] = None,
+	          time_limit: Optional[float] = None, relative_gap: Optional[float] = None,
+	          progress: Optional[Callable] = None, handle: Optional[SolveHandle] = None,
+	          metrics: Optional[SolveMetrics] = None) -> Tuple:
+		"""
+		Run the race
+		:param data: Data matrix
+		:param bounds: Presolve result, its bounds and coloring are given to every strategy
+		:param hint: Feasible grouping (group id per product), taken as the first incumbent
+		:param time_limit: Seconds after which the best grouping found by any strategy is returned
+		:param relative_gap: Relative gap at which the solvers stop
+		:param progress: Called with (objective, best_bound, seconds) when the shared bounds improve
+		:param handle: Used by another thread to stop the race
+		:param metrics: Receives the race duration as the solve phase
+		:return: None, pair_product_group_list and var_count of the winning strategy (with 'strategy')
+		"""
+		metrics = metrics if metrics is not None else SolveMetrics()
+		start = time.perf_counter()
+		num_product = data['num_product']
+		strategies = list(self.strategies)
+		if not accepts_own_groups(data['comp_matrix']):
+			strategies = [strategy for strategy in strategies if strategy != 'heuristic']
+			hint = None
+		if hint is None and bounds is not None:
+			hint = bounds['coloring']
+
+		best = {'pairs': None, 'objective': math.inf, 'strategy': None, 'var_count': None}
+		lower_bound = multiprocessing.Value('i', bounds['lower_bound'] if bounds is not None else 0)
+		upper_bound = multiprocessing.Value('i', num_product + 1)
+
+		def improve(pairs, objective, strategy, var_count):
+			if objective < best['objective']:
+				best.update(pairs=pairs, objective=objective, strategy=strategy, var_count=var_count)
+				upper_bound.value = objective
+				if progress is not None:
+					progress(objective, lower_bound.value, time.perf_counter() - start)
+
+		if hint is not None:
+			improve(coloring_to_pairs(hint), len(set(hint)), 'presolve', None)
+
+		results = multiprocessing.Queue()
+		backend_kwargs = {'builder': self.builder, 'num_search_workers': self.num_search_workers}
+		processes = {}
+		for strategy in strategies:
+			process = multiprocessing.Process(target=_race_worker, daemon=True,
+			                                  args=(strategy, backend_kwargs, data, bounds, time_limit, relative_gap,
+			                                        lower_bound, upper_bound, results))
+			process.start()
+			processes[strategy] = process
+		cancelled = threading.Event()
+		if handle is not None and not handle.attach(cancelled.set):
+			cancelled.set()
+
+		deadline = start + time_limit + 1 if time_limit is not None else None
+		running = set(strategies)
+		with metrics.phase('solve'):
+			while running and best['objective'] > lower_bound.value and not cancelled.is_set():
+				if deadline is not None and time.perf_counter() > deadline:
+					break
+				try:
+					message = results.get(timeout=0.05)
+				except queue.Empty:
+					running = {strategy for strategy in running if processes[strategy].is_alive()}
+					continue
+				kind, strategy = message[0], message[1]
+				if kind == 'incumbent':
+					improve(coloring_to_pairs(message[2]), len(set(message[2])), strategy, None)
+				elif kind == 'bound':
+					new_bound = math.ceil(message[3] - 1e-6)
+					if new_bound > lower_bound.value:
+						lower_bound.value = new_bound
+						if progress is not None:
+							progress(best['objective'], new_bound, time.perf_counter() - start)
+				elif kind == 'done':
+					running.discard(strategy)
+					pair_product_group_list, var_count = message[2], message[3]
+					if pair_product_group_list is not None:
+						improve(pair_product_group_list, var_count['objective'], strategy, var_count)
+						if var_count['status'] == 'OPTIMAL':
+							lower_bound.value = max(lower_bound.value, var_count['objective'])
+				else:
+					running.discard(strategy)
+					print("Portfolio strategy {0} failed - {1}".format(strategy, message[2]))
+		if handle is not None:
+			handle.detach()
+		# Tell the solvers to stop, then kill whatever is left
+		upper_bound.value = lower_bound.value
+		for process in processes.values():
+			process.join(0.1)
+			if process.is_alive():
+				process.terminate()
+				process.join()
+
+		if best['pairs'] is None:
+			return None, None, {'num_group': 0, 'num_compat_var': 0, 'num_constraints': 0}
+		var_count = dict(best['var_count'] or {'num_group': 0, 'num_compat_var': 0, 'num_constraints': 0})
+		status = 'OPTIMAL' if best['objective'] <= lower_bound.value else 'FEASIBLE'
+		var_count.update(solution_info(status, best['objective'], min(lower_bound.value, best['objective'])))
+		var_count['strategy'] = best['strategy']
+		return None, sorted(best['pairs'], key=lambda x: x[1]), var_count
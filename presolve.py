@@ -0,0 +1,289 @@
+import random
+from typing import Callable, Dict, List, Optional, Set
+
+
+def accepts_own_groups(comp_matrix) -> bool:
+	"""
+	Whether every product accepts its own group, the diagonal being all 1. Groupings are then exactly the
+	colorings of the incompatibility graph; a product refused in its own group can neither host a group
+	nor follow another product into one
+	:param comp_matrix: Compatibility matrix
+	:return: Whether coloring based methods apply
+	"""
+	return all(comp_matrix[i][i] == 1 for i in range(len(comp_matrix)))
+
+
+def incompatibility_graph(comp_matrix) -> List[Set[int]]:
+	"""
+	Build the undirected incompatibility graph, i and j being adjacent when either direction is 0
+	:param comp_matrix: Compatibility matrix
+	:return: Adjacency sets
+	"""
+	num_product = len(comp_matrix)
+	adjacency = [set() for _ in range(num_product)]
+	for i in range(num_product):
+		for j in range(i + 1, num_product):
+			if comp_matrix[i][j] != 1 or comp_matrix[j][i] != 1:
+				adjacency[i].add(j)
+				adjacency[j].add(i)
+	return adjacency
+
+
+def dsatur_coloring(adjacency: List[Set[int]]) -> List[int]:
+	"""
+	Greedy DSATUR coloring: color next the vertex seeing the most distinct colors, ties broken by degree
+	:param adjacency: Adjacency sets
+	:return: Color of each vertex, colors numbered from 0
+	"""
+	num_vertex = len(adjacency)
+	coloring = [-1] * num_vertex
+	neighbour_colors = [set() for _ in range(num_vertex)]
+	for _ in range(num_vertex):
+		vertex = max((v for v in range(num_vertex) if coloring[v] == -1),
+		             key=lambda v: (len(neighbour_colors[v]), len(adjacency[v]), -v))
+		color = 0
+		while color in neighbour_colors[vertex]:
+			color += 1
+		coloring[vertex] = color
+		for neighbour in adjacency[vertex]:
+			neighbour_colors[neighbour].add(color)
+	return coloring
+
+
+def max_clique(adjacency: List[Set[int]], node_limit: int = 100000) -> List[int]:
+	"""
+	Branch and bound maximum clique, pruned with a greedy coloring bound
+	:param adjacency: Adjacency sets
+	:param node_limit: Number of search nodes after which the best clique found so far is returned
+	:return: Vertices of the clique (maximum unless node_limit was reached)
+	"""
+	best = []
+	nodes = 0
+
+	def color_bound(candidates):
+		# Sequential coloring of the candidates, a clique uses at most one vertex per color
+		color_classes = []
+		for v in candidates:
+			for color_class in color_classes:
+				if not adjacency[v] & color_class:
+					color_class.add(v)
+					break
+			else:
+				color_classes.append({v})
+		order, bounds = [], []
+		for color, color_class in enumerate(color_classes, start=1):
+			for v in color_class:
+				order.append(v)
+				bounds.append(color)
+		return order, bounds
+
+	def expand(clique, candidates):
+		nonlocal best, nodes
+		order, bounds = color_bound(candidates)
+		for index in range(len(order) - 1, -1, -1):
+			nodes += 1
+			if nodes > node_limit or len(clique) + bounds[index] <= len(best):
+				return
+			v = order[index]
+			new_clique = clique + [v]
+			new_candidates = [u for u in order[:index] if u in adjacency[v]]
+			if new_candidates:
+				expand(new_clique, new_candidates)
+			elif len(new_clique) > len(best):
+				best = new_clique
+
+	vertices = sorted(range(len(adjacency)), key=lambda v: len(adjacency[v]), reverse=True)
+	expand([], vertices)
+	return sorted(best)
+
+
+def clique_cover(adjacency: List[Set[int]]) -> List[List[int]]:
+	"""
+	Cover every edge with greedy maximal cliques, each uncovered edge seeding a clique
+	grown with the vertex bringing the most uncovered edges
+	:param adjacency: Adjacency sets
+	:return: Sorted cliques of at least two vertices
+	"""
+	covered = [set() for _ in adjacency]
+	cliques = []
+	for u in sorted(range(len(adjacency)), key=lambda v: len(adjacency[v]), reverse=True):
+		for v in sorted(adjacency[u]):
+			if v in covered[u]:
+				continue
+			clique = [u, v]
+			candidates = adjacency[u] & adjacency[v]
+			while candidates:
+				w = max(candidates, key=lambda c: (sum(x not in covered[c] for x in clique), -c))
+				clique.append(w)
+				candidates &= adjacency[w]
+			for x in clique:
+				covered[x].update(clique)
+			cliques.append(sorted(clique))
+	return cliques
+
+
+def tabu_coloring(adjacency: List[Set[int]], num_colors: int, coloring: List[int], max_iterations: int = 10000,
+                  seed: int = 0, stop: Optional[Callable[[], bool]] = None) -> Optional[List[int]]:
+	"""
+	TabuCol local search for a coloring with num_colors colors: recolor a conflicting vertex with the color
+	reducing conflicts the most, the previous color of a moved vertex being forbidden for a few iterations
+	:param adjacency: Adjacency sets
+	:param num_colors: Number of colors allowed
+	:param coloring: Starting coloring, colors beyond num_colors are redrawn
+	:param max_iterations: Number of moves before giving up
+	:param seed: Random seed of the redraws and tie breaks
+	:param stop: Polled every hundred moves, the search is abandoned when it returns True
+	:return: Coloring without conflict, None when none was found
+	"""
+	rng = random.Random(seed)
+	num_vertex = len(adjacency)
+	coloring = [color if color < num_colors else rng.randrange(num_colors) for color in coloring]
+	# conflicts[v][c] = number of neighbours of v colored c
+	conflicts = [[0] * num_colors for _ in range(num_vertex)]
+	for v in range(num_vertex):
+		for u in adjacency[v]:
+			conflicts[v][coloring[u]] += 1
+	total = sum(conflicts[v][coloring[v]] for v in range(num_vertex)) // 2
+	best_total = total
+	tabu = {}
+	for iteration in range(max_iterations):
+		if total == 0:
+			return coloring
+		if stop is not None and iteration % 100 == 0 and stop():
+			return None
+		move, move_key = None, None
+		conflicting = 0
+		for v in range(num_vertex):
+			current = coloring[v]
+			if conflicts[v][current] == 0:
+				continue
+			conflicting += 1
+			for color in range(num_colors):
+				if color == current:
+					continue
+				delta = conflicts[v][color] - conflicts[v][current]
+				# A tabu move is still taken when it beats the best state seen (aspiration)
+				if tabu.get((v, color), -1) >= iteration and total + delta >= best_total:
+					continue
+				key = (delta, rng.random())
+				if move_key is None or key < move_key:
+					move, move_key = (v, color), key
+		if move is None:
+			continue
+		v, color = move
+		previous = coloring[v]
+		coloring[v] = color
+		for u in adjacency[v]:
+			conflicts[u][previous] -= 1
+			conflicts[u][color] += 1
+		total += move_key[0]
+		best_total = min(best_total, total)
+		tabu[v, previous] = iteration + int(0.6 * conflicting) + rng.randrange(10)
+	return coloring if total == 0 else None
+
+
+def repair_coloring(adjacency: List[Set[int]], coloring: List[int]) -> List[int]:
+	"""
+	Make a coloring proper: each vertex keeps its color unless a neighbour colored before it already has it,
+	it then takes the smallest color none of those neighbours has
+	:param adjacency: Adjacency sets
+	:param coloring: Color of each vertex, possibly with conflicts
+	:return: Coloring without conflict
+	"""
+	repaired = [-1] * len(adjacency)
+	for v in range(len(adjacency)):
+		taken = {repaired[u] for u in adjacency[v] if repaired[u] != -1}
+		color = coloring[v]
+		if color in taken:
+			color = 0
+			while color in taken:
+				color += 1
+		repaired[v] = color
+	return repaired
+
+
+def representative_assignment(coloring: List[int]) -> List[int]:
+	"""
+	Map each color class to its smallest product, which every member is compatible with,
+	so that the class can use that product's group in the assignment model
+	:param coloring: Color of each product
+	:return: Group (product index) of each product
+	"""
+	representative = {}
+	for i, color in enumerate(coloring):
+		representative.setdefault(color, i)
+	return [representative[color] for color in coloring]
+
+
+def coloring_to_pairs(coloring: List[int]) -> List[List[int]]:
+	"""
+	Convert a coloring into the pair_product_group_list format of ProductOptimizer.process_result,
+	labels being re-based on the first opened group
+	:param coloring: Color of each product
+	:return: List of [product, group] sorted by group
+	"""
+	assignment = representative_assignment(coloring)
+	min_index_group = min(assignment, default=0)
+	pair_product_group_list = [[i, group - min_index_group] for i, group in enumerate(assignment)]
+	return sorted(pair_product_group_list, key=lambda x: x[1])
+
+
+def solution_info(status: str, objective: float, best_bound: float) -> Dict:
+	"""
+	Describe the quality of a grouping
+	:param status: 'OPTIMAL' or 'FEASIBLE'
+	:param objective: Number of groups of the grouping
+	:param best_bound: Proven lower bound on the number of groups
+	:return: Status, objective, bound and relative gap
+	"""
+	gap = (objective - best_bound) / objective if objective > 0 else 0.0
+	return {
+		'status': status,
+		'objective': objective,
+		'best_bound': best_bound,
+		'gap': max(gap, 0.0)
+	}
+
+
+def proven_var_count(num_groups: int) -> Dict:
+	"""
+	var_count of a grouping proven optimal without building a model
+	:param num_groups: Number of groups
+	:return: Zero model size and an optimal solution_info
+	"""
+	var_count = {
+		'num_group': 0,
+		'num_compat_var': 0,
+		'num_constraints': 0
+	}
+	var_count.update(solution_info('OPTIMAL', num_groups, num_groups))
+	return var_count
+
+
+def presolve(data: Dict) -> Dict:
+	"""
+	Bound the number of groups with a clique (lower) and a DSATUR coloring (upper)
+	:param data: Data matrix
+	:return: Bounds, coloring and clique, plus the grouping when both bounds match
+	"""
+	comp_matrix = data['comp_matrix']
+	num_product = data['num_product']
+	result = {
+		'lower_bound': 0,
+		'upper_bound': num_product,
+		'coloring': None,
+		'clique': [],
+		'pair_product_group_list': None
+	}
+	if not accepts_own_groups(comp_matrix):
+		return result
+	adjacency = incompatibility_graph(comp_matrix)
+	coloring = dsatur_coloring(adjacency)
+	clique = max_clique(adjacency)
+	result['coloring'] = coloring
+	result['clique'] = clique
+	result['upper_bound'] = len(set(coloring))
+	result['lower_bound'] = len(clique)
+	if result['lower_bound'] == result['upper_bound']:
+		result['pair_product_group_list'] = coloring_to_pairs(coloring)
+	return result
@@ -0,0 +1,80 @@
+import numpy as np
+from typing import Dict, List, Optional
+from decomposition import sub_data_model
+from presolve import accepts_own_groups, coloring_to_pairs
+
+
+def reduce_data(data: Dict) -> Optional[Dict]:
+	"""
+	Remove every product that can always join the group of another one: products compatible with the
+	whole selection, products with the same compatibility row as another one and, more generally,
+	products whose incompatibilities are all shared by a compatible product. Repeated until nothing
+	is removed, the number of groups needed by the selection is unchanged.
+	:param data: Data matrix
+	:return: Reduced data matrix under 'data', kept product indexes under 'kept' and the removed
+	         (product, host) pairs in removal order under 'removed', None when nothing can be removed
+	"""
+	num_product = data['num_product']
+	allowed = np.asarray(data['comp_matrix']).reshape(num_product, num_product) == 1
+	if num_product < 2 or not accepts_own_groups(allowed):
+		return None
+	incompatible = ~(allowed & allowed.T)
+	np.fill_diagonal(incompatible, False)
+
+	alive = np.ones(num_product, dtype=bool)
+	removed = []
+	changed = True
+	while changed:
+		changed = False
+		index = np.flatnonzero(alive)
+		sub = incompatible[np.ix_(index, index)].astype(np.float32)
+		# outside[a, b] = number of incompatibilities of a that b does not share
+		outside = sub @ (1 - sub).T
+		hosts = (outside == 0) & (sub == 0)
+		np.fill_diagonal(hosts, False)
+		degree = sub.sum(axis=1)
+		# Products with the fewest incompatibilities first, universally compatible ones leading
+		for a in np.argsort(degree, kind='stable').tolist():
+			candidates = np.flatnonzero(hosts[a] & alive[index])
+			if len(candidates):
+				host = candidates[np.argmax(degree[candidates])]
+				alive[index[a]] = False
+				removed.append((int(index[a]), int(index[host])))
+				changed = True
+
+	if not removed:
+		return None
+	kept = np.flatnonzero(alive).tolist()
+	reduced = sub_data_model(data, kept)
+	if 'cliques' in data:
+		# Restricted cliques still cover every incompatible pair of the kept products
+		position = {i: p for p, i in enumerate(kept)}
+		cliques = [[position[i] for i in clique if i in position] for clique in data['cliques']]
+		reduced['cliques'] = [clique for clique in cliques if len(clique) > 1]
+	return {'data': reduced, 'kept': kept, 'removed': removed}
+
+
+def reduce_coloring(reduction: Dict, coloring: List[int]) -> List[int]:
+	"""
+	:param reduction: Result of reduce_data
+	:param coloring: Group id of each product of the full selection
+	:return: Group id of each kept product
+	"""
+	return [coloring[i] for i in reduction['kept']]
+
+
+def expand_grouping(reduction: Dict, pair_product_group_list: List, num_product: int) -> List[List[int]]:
+	"""
+	Put the removed products back, each one in the group of its host
+	:param reduction: Result of reduce_data
+	:param pair_product_group_list: Grouping of the reduced data matrix
+	:param num_product: Number of products of the full selection
+	:return: pair_product_group_list of the full selection, sorted by group
+	"""
+	coloring = [None] * num_product
+	for local_index, group in pair_product_group_list:
+		coloring[reduction['kept'][local_index]] = group
+	# Hosts removed later are placed first, as each product was dominated in the graph left at its removal
+	for product, host in reversed(reduction['removed']):
+		coloring[product] = coloring[host]
+	return coloring_to_pairs(coloring)
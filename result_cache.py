@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+
+def matrix_hash(matrix, product_names: List) -> str:
+	"""
+	Fingerprint a retention matrix, any change in values or names gives a new hash
+	:param matrix: Full compatibility matrix (array or nested lists)
+	:param product_names: Names of the matrix columns
+	:return: Hex digest
+	"""
+	digest = hashlib.sha256()
+	digest.update(json.dumps([str(name) for name in product_names]).encode())
+	if hasattr(matrix, 'astype'):
+		# Same bytes as the row by row path, without a Python loop over the catalog
+		digest.update(matrix.astype('uint8').tobytes())
+	else:
+		for row in matrix:
+			digest.update(bytes(int(value) & 0xff for value in row))
+	return digest.hexdigest()
+
+
+def canonical_order(list_name: List) -> List[int]:
+	"""
+	Order of the requested products once sorted by name, so that permutations share a cache entry
+	:param list_name: Requested products
+	:return: Indexes of list_name in canonical order
+	"""
+	return sorted(range(len(list_name)), key=lambda i: str(list_name[i]))
+
+
+def relabel_groups(pair_product_group_list: List) -> List[List[int]]:
+	"""
+	Label each group with its smallest product, re-based on the first group
+	:param pair_product_group_list: List of [product, group]
+	:return: Relabelled list sorted by group
+	"""
+	representative = {}
+	for i, group in pair_product_group_list:
+		representative[group] = min(i, representative.get(group, i))
+	min_index_group = min(representative.values(), default=0)
+	pair_product_group_list = [[i, representative[group] - min_index_group] for i, group in pair_product_group_list]
+	return sorted(pair_product_group_list, key=lambda x: (x[1], x[0]))
+
+
+def default_cache_path(retention_csv: str) -> Optional[str]:
+	"""
+	Result file shared by every caller of a catalog, the CLI and the GUI alike: next to the catalog,
+	a csv and its binary conversion sharing it
+	:param retention_csv: Path of the catalog
+	:return: SQLite path, None when the catalog directory is not writable
+	"""
+	path = os.path.splitext(os.path.abspath(retention_csv))[0] + '.results.sqlite'
+	if not os.access(os.path.dirname(path), os.W_OK):
+		return None
+	return path
+
+
+class ResultCache:
+	"""
+	Two tier cache of solved selections: a bounded in-memory LRU in front of an optional SQLite file.
+	Entries are keyed by the matrix hash and the sorted product names, so several catalogs may share a file.
+	Rows of a matrix that is no longer used are dropped lazily, by the LRU eviction and once unused for max_age.
+	"""
+	def __init__(self, matrix_digest: str, path: Optional[str] = None, max_entries: int = 256,
+	             max_disk_entries: int = 100000, max_age: float = 30 * 24 * 3600):
+		"""
+		:param matrix_digest: matrix_hash of the catalog the results belong to
+		:param path: SQLite file of the on-disk tier, None to keep results in memory only
+		:param max_entries: Size of the in-memory LRU
+		:param max_disk_entries: Number of rows kept on disk, least recently used ones are evicted
+		:param max_age: Seconds after which a row that was not looked up is evicted
+		"""
+		self.matrix_digest = matrix_digest
+		self.max_entries = max_entries
+		self.max_disk_entries = max_disk_entries
+		self.max_age = max_age
+		self.memory = OrderedDict()
+		self.lock = threading.Lock()
+		self.connection = None
+		if path is not None:
+			self.connection = sqlite3.connect(path, check_same_thread=False)
+			self.connection.execute("CREATE TABLE IF NOT EXISTS results (matrix_hash TEXT, products TEXT, "
+			                        "result TEXT, accessed REAL, PRIMARY KEY (matrix_hash, products))")
+			self.connection.commit()
+
+	def get(self, list_name: List) -> Optional[Tuple[List, Dict]]:
+		"""
+		Look a selection up
+		:param list_name: Requested products
+		:return: pair_product_group_list indexed like list_name and var_count, None on a miss
+		"""
+		order = canonical_order(list_name)
+		key = json.dumps([str(list_name[i]) for i in order])
+		with self.lock:
+			entry = self.memory.get(key)
+			if entry is not None:
+				self.memory.move_to_end(key)
+			elif self.connection is not None:
+				now = time.time()
+				# Expired rows are a miss here, the put that follows deletes them
+				row = self.connection.execute("SELECT result FROM results WHERE matrix_hash = ? AND products = ? "
+				                              "AND accessed >= ?", (self.matrix_digest, key, now - self.max_age)).fetchone()
+				if row is not None:
+					entry = json.loads(row[0])
+					self.connection.execute("UPDATE results SET accessed = ? WHERE matrix_hash = ? AND products = ?",
+					                        (now, self.matrix_digest, key))
+					self.connection.commit()
+					self._remember(key, entry)
+		if entry is None:
+			return None
+		pair_product_group_list = relabel_groups([[order[position], group] for position, group in entry['groups']])
+		return pair_product_group_list, dict(entry['var_count'])
+
+	def put(self, list_name: List, pair_product_group_list: List, var_count: Dict) -> None:
+		"""
+		Store a solved selection
+		:param list_name: Requested products
+		:param pair_product_group_list: List of [product, group] indexed like list_name
+		:param var_count: Model size of the solve
+		"""
+		order = canonical_order(list_name)
+		position = {index: p for p, index in enumerate(order)}
+		key = json.dumps([str(list_name[i]) for i in order])
+		entry = {
+			'groups': [[position[i], int(group)] for i, group in pair_product_group_list],
+			'var_count': dict(var_count)
+		}
+		with self.lock:
+			self._remember(key, entry)
+			if self.connection is not None:
+				now = time.time()
+				self.connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+				                        (self.matrix_digest, key, json.dumps(entry), now))
+				self.connection.execute("DELETE FROM results WHERE accessed < ?", (now - self.max_age,))
+				self.connection.execute("DELETE FROM results WHERE rowid IN (SELECT rowid FROM results "
+				                        "ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_disk_entries,))
+				self.connection.commit()
+
+	def _remember(self, key: str, entry: Dict) -> None:
+		self.memory[key] = entry
+		self.memory.move_to_end(key)
+		while len(self.memory) > self.max_entries:
+			self.memory.popitem(last=False)
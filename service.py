@@ -0,0 +1,202 @@
+import argparse
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from catalog import UnknownProductsError
+from grouping import Grouping
+
+DEFAULT_PORT = 8765
+
+_optimizer = None
+
+
+def _init_worker(optimizer_kwargs: Dict) -> None:
+	"""Load the catalog once per worker process"""
+	global _optimizer
+	from optimizer import ProductOptimizer
+	_optimizer = ProductOptimizer(**optimizer_kwargs)
+
+
+def _solve(products: List, time_limit: Optional[float] = None, relative_gap: Optional[float] = None) -> Dict:
+	"""
+	:param products: List of products to use
+	:param time_limit: Seconds after which the best incumbent is returned
+	:param relative_gap: Relative gap at which the search stops
+	:return: JSON-able result of run_simulation
+	"""
+	_, grouping, data, var_count = _optimizer.run_simulation(products, time_limit, relative_gap)
+	return {
+		'pair_product_group_list': grouping.to_pairs() if grouping is not None else None,
+		'comp_matrix': data['comp_matrix'],
+		'name_product': list(data['name_product']),
+		'var_count': var_count
+	}
+
+
+def solve_settings(optimizer_kwargs: Dict) -> Dict:
+	"""
+	Settings deciding how a daemon solves, to be compared with those of a caller
+	:param optimizer_kwargs: Arguments of ProductOptimizer
+	:return: JSON-able arguments, paths made absolute and the metrics hook left out
+	"""
+	settings = {name: value for name, value in optimizer_kwargs.items() if name != 'metrics_hook'}
+	for name in ('retention_csv', 'cache_path', 'model_cache_path'):
+		if settings.get(name):
+			settings[name] = os.path.abspath(settings[name])
+	return json.loads(json.dumps(settings))
+
+
+def serve(optimizer_kwargs: Dict, host: str = '127.0.0.1', port: int = DEFAULT_PORT, workers: int = 4,
+          max_queue: int = 64, timeout: Optional[float] = None) -> None:
+	"""
+	Run the solve daemon: POST /solve {"products": [...], "time_limit": s, "relative_gap": g}
+	and GET /health, JSON in and out.
+	Requests beyond the workers and the queue are refused with 503 so that callers back off.
+	:param optimizer_kwargs: Arguments of ProductOptimizer, each worker process loads its own instance
+	:param host: Interface to bind, keep it local
+	:param port: TCP port
+	:param workers: Number of solver processes
+	:param max_queue: Number of requests allowed to wait for a worker
+	:param timeout: Seconds after which a waiting request gets a 504, None for no limit
+	"""
+	executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(optimizer_kwargs,))
+	slots = threading.BoundedSemaphore(workers + max_queue)
+	retention_csv = os.path.abspath(optimizer_kwargs['retention_csv'])
+	settings = solve_settings(optimizer_kwargs)
+
+	class Handler(BaseHTTPRequestHandler):
+		def _reply(self, code, body, headers=()):
+			payload = json.dumps(body, default=int).encode()
+			self.send_response(code)
+			self.send_header('Content-Type', 'application/json')
+			self.send_header('Content-Length', str(len(payload)))
+			for name, value in headers:
+				self.send_header(name, value)
+			self.end_headers()
+			self.wfile.write(payload)
+
+		def do_GET(self):
+			if self.path != '/health':
+				return self._reply(404, {'error': 'unknown path'})
+			self._reply(200, {'status': 'ok', 'retention_csv': retention_csv, 'settings': settings})
+
+		def do_POST(self):
+			if self.path != '/solve':
+				return self._reply(404, {'error': 'unknown path'})
+			try:
+				request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+				products = list(request['products'])
+				time_limit, relative_gap = request.get('time_limit'), request.get('relative_gap')
+			except (ValueError, KeyError, TypeError) as error:
+				return self._reply(400, {'error': 'bad request: {0}'.format(error)})
+			if not slots.acquire(blocking=False):
+				return self._reply(503, {'error': 'queue full'}, [('Retry-After', '1')])
+			try:
+				future = executor.submit(_solve, products, time_limit, relative_gap)
+			except Exception as error:
+				slots.release()
+				return self._reply(500, {'error': '{0}: {1}'.format(type(error).__name__, error)})
+			# The slot is held until the job ends, a request that timed out still occupies a worker
+			future.add_done_callback(lambda _: slots.release())
+			try:
+				result = future.result(timeout=timeout)
+			except TimeoutError:
+				return self._reply(504, {'error': 'timeout after {0} s'.format(timeout)})
+			except UnknownProductsError as error:
+				return self._reply(400, {'error': str(error), 'unknown_products': error.names})
+			except Exception as error:
+				return self._reply(500, {'error': '{0}: {1}'.format(type(error).__name__, error)})
+			self._reply(200, result)
+
+		def log_message(self, format, *args):
+			pass
+
+	server = ThreadingHTTPServer((host, port), Handler)
+	print("Serving {0} on http://{1}:{2}".format(retention_csv, host, port))
+	try:
+		server.serve_forever()
+	finally:
+		server.server_close()
+		executor.shutdown(cancel_futures=True)
+
+
+class ServiceClient:
+	"""
+	Thin client of the solve daemon, only needs the standard library
+	"""
+	def __init__(self, url: str = 'http://127.0.0.1:{0}'.format(DEFAULT_PORT), timeout: Optional[float] = None):
+		"""
+		:param url: Base URL of the daemon
+		:param timeout: Seconds to wait for a solve, None for no limit
+		"""
+		self.url = url.rstrip('/')
+		self.timeout = timeout
+
+	def health(self, timeout: float = 0.2) -> Optional[Dict]:
+		"""
+		:param timeout: Connection timeout in seconds
+		:return: Health payload, None when no daemon answers
+		"""
+		try:
+			with urllib.request.urlopen(self.url + '/health', timeout=timeout) as response:
+				return json.loads(response.read())
+		except (OSError, ValueError):
+			return None
+
+	def serves(self, optimizer_kwargs: Dict) -> bool:
+		"""
+		:param optimizer_kwargs: Arguments of the ProductOptimizer the caller would create
+		:return: Whether a daemon is running with these same settings, so that it solves as the caller would
+		"""
+		health = self.health()
+		return health is not None and health.get('settings') == solve_settings(optimizer_kwargs)
+
+	def run_simulation(self, list_name: List, time_limit: Optional[float] = None,
+	                   relative_gap: Optional[float] = None):
+		"""
+		Same return shape as ProductOptimizer.run_simulation, the solver staying in the daemon
+		:param list_name: List of products to use
+		:param time_limit: Seconds after which the best incumbent is returned
+		:param relative_gap: Relative gap at which the search stops
+		:return: None, Grouping (None when no solution was found), data and var_count
+		:raise UnknownProductsError: When a product is not in the daemon's catalog
+		"""
+		body = {'products': list(list_name), 'time_limit': time_limit, 'relative_gap': relative_gap}
+		request = urllib.request.Request(self.url + '/solve', data=json.dumps(body).encode(),
+		                                 headers={'Content-Type': 'application/json'})
+		try:
+			with urllib.request.urlopen(request, timeout=self.timeout) as response:
+				result = json.loads(response.read())
+		except urllib.error.HTTPError as error:
+			answer = error.read().decode()
+			if error.code == 400:
+				unknown = json.loads(answer).get('unknown_products')
+				if unknown:
+					raise UnknownProductsError(unknown) from error
+			raise RuntimeError("Solve daemon answered {0}: {1}".format(error.code, answer)) from error
+		data = {
+			'comp_matrix': result['comp_matrix'],
+			'num_product': len(result['comp_matrix']),
+			'name_product': result['name_product']
+		}
+		grouping = None
+		if result['pair_product_group_list'] is not None:
+			grouping = Grouping.from_pairs(result['pair_product_group_list'], data['num_product'],
+			                               result['var_count'].get('status'))
+		return None, grouping, data, result['var_count']
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Client du démon de résolution")
+	parser.add_argument('products', metavar='P', type=str, nargs='+',
+	                    help='Liste des produits pour optimization')
+	parser.add_argument('--url', type=str, default='http://127.0.0.1:{0}'.format(DEFAULT_PORT),
+	                    help="Adresse du démon")
+	args = parser.parse_args()
+	_, grouping, data, _ = ServiceClient(args.url).run_simulation(args.products)
+	print(json.dumps({'groups': grouping.names(data['name_product']) if grouping is not None else None}))
@@ -0,0 +1,134 @@
+from typing import Callable, Dict, List, Optional, Tuple
+from metrics import SolveMetrics
+from presolve import coloring_to_pairs, presolve, proven_var_count
+from reduction import expand_grouping, reduce_coloring, reduce_data
+
+
+def repair_grouping(previous: Dict, data: Dict) -> List[int]:
+	"""
+	Adapt the previous grouping to a new selection: kept products stay in their group when it is
+	still compatible, the others go to the first compatible group or open a new one
+	:param previous: Group id of each product name in the previous solution
+	:param data: Data matrix of the new selection
+	:return: Group id of each product of the new selection, numbered from 0
+	"""
+	comp_matrix = data['comp_matrix']
+	names = list(data['name_product'])
+	groups = []
+	coloring = [-1] * data['num_product']
+
+	def compatible(i, members):
+		return all(comp_matrix[i][j] == 1 and comp_matrix[j][i] == 1 for j in members)
+
+	def place(i, candidates):
+		for g in candidates:
+			if compatible(i, groups[g]):
+				groups[g].append(i)
+				coloring[i] = g
+				return True
+		return False
+
+	previous_group = {}
+	for i, name in enumerate(names):
+		if name in previous:
+			group_id = previous_group.setdefault(previous[name], len(groups))
+			if group_id == len(groups):
+				groups.append([])
+			place(i, [group_id])
+	for i in range(data['num_product']):
+		if coloring[i] == -1 and not place(i, range(len(groups))):
+			groups.append([i])
+			coloring[i] = len(groups) - 1
+
+	# Groups emptied by removed or moved products are dropped from the numbering
+	used = {g: rank for rank, g in enumerate(sorted(set(coloring)))}
+	return [used[g] for g in coloring]
+
+
+class IncrementalSession:
+	"""
+	Keep the last grouping between runs and repair it for the next selection,
+	the solver then starts from the repaired solution and only has to prove optimality
+	"""
+	def __init__(self, backend, use_presolve: bool = True, use_reduction: bool = True):
+		"""
+		:param backend: Solving backend
+		:param use_presolve: Try coloring and clique bounds before solving
+		:param use_reduction: Remove products that can always follow another one before solving
+		"""
+		self.backend = backend
+		self.use_presolve = use_presolve
+		self.use_reduction = use_reduction
+		self.previous = None
+
+	def reset(self) -> None:
+		"""Forget the last solution"""
+		self.previous = None
+
+	def run(self, data: Dict, time_limit: Optional[float] = None, relative_gap: Optional[float] = None,
+	        progress: Optional[Callable] = None, handle=None,
+	        metrics: Optional[SolveMetrics] = None) -> Tuple[Optional[object], List, Dict]:
+		"""
+		Group a verified data matrix, warm-started from the previous run
+		:param data: Data matrix
+		:param time_limit: Seconds after which the best incumbent is returned
+		:param relative_gap: Relative gap at which the search stops
+		:param progress: Called with (objective, best_bound, seconds) on improving solutions
+		:param handle: backends.SolveHandle used by another thread to interrupt the solve
+		:param metrics: Receives the presolve (including the repair), build, solve and extraction times
+		:return: Solver (None when no solve was needed), pair_product_group_list and var_count
+		"""
+		metrics = metrics if metrics is not None else SolveMetrics()
+		full_data = data
+		solver = None
+		hint = None
+		bounds = None
+		reduction = None
+		with metrics.phase('presolve'):
+			if self.previous is not None:
+				hint = repair_grouping(self.previous, data)
+
+			if self.use_reduction:
+				reduction = reduce_data(data)
+			if reduction is not None:
+				# The repaired grouping restricted to the kept products still separates their incompatibilities
+				data = reduction['data']
+				if hint is not None:
+					hint = reduce_coloring(reduction, hint)
+
+			if self.use_presolve:
+				bounds = presolve(data)
+				if hint is not None and bounds['coloring'] is not None:
+					num_repaired = len(set(hint))
+					if num_repaired < bounds['upper_bound']:
+						bounds['upper_bound'] = num_repaired
+						bounds['coloring'] = hint
+					if num_repaired == bounds['lower_bound']:
+						bounds['pair_product_group_list'] = coloring_to_pairs(hint)
+					hint = bounds['coloring']
+
+		if bounds is not None and bounds['pair_product_group_list'] is not None:
+			pair_product_group_list = bounds['pair_product_group_list']
+			var_count = proven_var_count(bounds['upper_bound'])
+		else:
+			if progress is not None and bounds is not None:
+				progress(bounds['upper_bound'], bounds['lower_bound'], 0.0)
+			solver, pair_product_group_list, var_count = self.backend.solve(data, bounds, hint, time_limit=time_limit,
+			                                                                relative_gap=relative_gap, progress=progress,
+			                                                                handle=handle, metrics=metrics)
+			if pair_product_group_list is None:
+				return solver, None, var_count
+
+		if reduction is not None:
+			pair_product_group_list = expand_grouping(reduction, pair_product_group_list, full_data['num_product'])
+		self.remember(full_data, pair_product_group_list)
+		return solver, pair_product_group_list, var_count
+
+	def remember(self, data: Dict, pair_product_group_list: List) -> None:
+		"""
+		Record a grouping obtained elsewhere (e.g. from a cache) as the starting point of the next run
+		:param data: Data matrix
+		:param pair_product_group_list: List of [product, group]
+		"""
+		names = list(data['name_product'])
+		self.previous = {names[i]: group for i, group in pair_product_group_list}
@@ -0,0 +1,63 @@
+from ortools.linear_solver import pywraplp
+import queue
+from contextlib import contextmanager
+from typing import Dict
+
+
+class SolverPool:
+	"""
+	Small pool of pre-created pywraplp solvers. A solver is borrowed for one model and given back
+	cleared, so that no variable or constraint survives from one request to the next.
+	"""
+	def __init__(self, solver_id: str = 'SCIP', size: int = 2):
+		"""
+		:param solver_id: Solver passed to pywraplp.Solver.CreateSolver
+		:param size: Number of idle solvers kept, more are created when they are all borrowed
+		"""
+		self.solver_id = solver_id
+		self.size = size
+		self.idle = queue.LifoQueue()
+		for _ in range(size):
+			self.idle.put(self._create())
+
+	def _create(self) -> pywraplp.Solver:
+		solver = pywraplp.Solver.CreateSolver(self.solver_id)
+		if solver is None:
+			raise RuntimeError("Solver {0} is not available in this OR-Tools build".format(self.solver_id))
+		return solver
+
+	def acquire(self) -> pywraplp.Solver:
+		"""
+		:return: An empty solver, owned by the caller until it is released
+		"""
+		try:
+			return self.idle.get_nowait()
+		except queue.Empty:
+			return self._create()
+
+	def release(self, solver: pywraplp.Solver) -> None:
+		"""
+		Clear a solver and make it available again, extra solvers beyond the pool size are dropped
+		:param solver: Solver returned by acquire, it must not be used by the caller afterwards
+		"""
+		solver.Clear()
+		# A limit of 0 means no limit, the next request sets its own
+		solver.SetTimeLimit(0)
+		if self.idle.qsize() < self.size:
+			self.idle.put(solver)
+
+	@contextmanager
+	def borrow(self):
+		"""Acquire a solver for the duration of a with block"""
+		solver = self.acquire()
+		try:
+			yield solver
+		finally:
+			self.release(solver)
+
+	def __getstate__(self) -> Dict:
+		# Solvers cannot cross processes, a copy sent to a worker starts with its own solvers
+		return {'solver_id': self.solver_id, 'size': self.size}
+
+	def __setstate__(self, state: Dict) -> None:
+		self.__init__(state['solver_id'], state['size'])
@@ -0,0 +1,271 @@
+import itertools
+import random
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('ortools')
+
+from backends import ScipBackend, create_backend
+from catalog import CompatibilityCatalog
+from decomposition import solve_decomposed, sub_data_model
+from metrics import SolveMetrics
+from model_cache import ModelCache
+from presolve import dsatur_coloring, incompatibility_graph, presolve
+from reduction import expand_grouping, reduce_data
+from result_cache import ResultCache
+from session import repair_grouping
+
+
+def random_data(seed: int, num_product: int = 7, density: float = 0.7):
+	"""
+	:param seed: Seed of the matrix
+	:param num_product: Number of products
+	:param density: Probability of each ordered pair being compatible
+	:return: Data matrix with an all 1 diagonal, so that its optimum is the chromatic number
+	"""
+	rng = random.Random(seed)
+	comp_matrix = [[1 if i == j or rng.random() < density else 0 for j in range(num_product)]
+	               for i in range(num_product)]
+	return {
+		'comp_matrix': comp_matrix,
+		'num_product': num_product,
+		'name_product': ['p{0}'.format(i) for i in range(num_product)]
+	}
+
+
+def chromatic_number(data) -> int:
+	"""
+	:param data: Data matrix
+	:return: Smallest number of groups, by enumerating the colorings
+	"""
+	adjacency = incompatibility_graph(data['comp_matrix'])
+	for num_colors in range(1, data['num_product'] + 1):
+		for coloring in itertools.product(range(num_colors), repeat=data['num_product']):
+			if all(coloring[i] != coloring[j] for i in range(data['num_product']) for j in adjacency[i]):
+				return num_colors
+	return data['num_product']
+
+
+def assert_valid(data, pair_product_group_list, objective: int) -> None:
+	"""
+	Every product is in exactly one group, two products of a group accept each other
+	and the number of groups is objective
+	"""
+	products = sorted(product for product, _ in pair_product_group_list)
+	assert products == list(range(data['num_product']))
+	group_of = dict(pair_product_group_list)
+	comp_matrix = data['comp_matrix']
+	for i, j in itertools.combinations(range(data['num_product']), 2):
+		if group_of[i] == group_of[j]:
+			assert comp_matrix[i][j] == 1 and comp_matrix[j][i] == 1
+	assert len(set(group_of.values())) == objective
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_presolve_bounds(seed):
+	data = random_data(seed)
+	optimum = chromatic_number(data)
+	bounds = presolve(data)
+	assert bounds['lower_bound'] <= optimum <= bounds['upper_bound']
+	assert_valid(data, [[i, group] for i, group in enumerate(bounds['coloring'])], bounds['upper_bound'])
+	if bounds['pair_product_group_list'] is not None:
+		assert_valid(data, bounds['pair_product_group_list'], optimum)
+
+
+@pytest.mark.parametrize('backend, builder', [
+	('scip', 'loop'), ('scip', 'vectorized'), ('scip', 'sparse'), ('scip', 'lazy'), ('scip', 'clique'),
+	('scip', 'representative'), ('cp-sat', 'vectorized'), ('colgen', 'vectorized'), ('portfolio', 'vectorized')
+])
+@pytest.mark.parametrize('seed', range(10))
+def test_reduced_solve(backend, builder, seed):
+	data = random_data(seed, density=0.8)
+	optimum = chromatic_number(data)
+	reduction = reduce_data(data)
+	reduced = reduction['data'] if reduction is not None else data
+	bounds = presolve(reduced)
+	# Most of these small selections are proven by the presolve, the model is solved anyway without its bounds
+	if bounds['pair_product_group_list'] is not None:
+		bounds = None
+	backend = create_backend(backend, builder, num_search_workers=2)
+	solver, pair_product_group_list, var_count = backend.solve(reduced, bounds)
+	backend.release(solver)
+	assert var_count['objective'] == optimum
+	if reduction is not None:
+		pair_product_group_list = expand_grouping(reduction, pair_product_group_list, data['num_product'])
+	assert_valid(data, pair_product_group_list, optimum)
+
+
+@pytest.mark.parametrize('builder', ['vectorized', 'sparse', 'lazy', 'clique', 'representative'])
+@pytest.mark.parametrize('seed', range(5))
+def test_model_cache_reorder(builder, seed):
+	data = random_data(seed)
+	optimum = chromatic_number(data)
+	backend = ScipBackend(builder, model_cache=ModelCache())
+	rng = random.Random(seed)
+	# In memory, stored on the second build and loaded by the later solves
+	for attempt in range(4):
+		order = list(range(data['num_product']))
+		rng.shuffle(order)
+		permuted = {
+			'comp_matrix': [[data['comp_matrix'][i][j] for j in order] for i in order],
+			'num_product': data['num_product'],
+			'name_product': [data['name_product'][i] for i in order]
+		}
+		metrics = SolveMetrics()
+		solver, pair_product_group_list, var_count = backend.solve(permuted, metrics=metrics)
+		backend.release(solver)
+		assert metrics.model_cache_hit == (attempt >= 2)
+		assert var_count['objective'] == optimum
+		assert_valid(permuted, pair_product_group_list, optimum)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_lazy_rounds_repair_incumbent(seed, monkeypatch):
+	import backends
+	data = random_data(seed, density=0.5)
+	reads, repaired = [], []
+	process_result = backends.process_result
+	repair_coloring = backends.repair_coloring
+
+	def read(*args, **kwargs):
+		reads.append(process_result(*args, **kwargs))
+		return reads[-1]
+
+	def repair(adjacency, coloring):
+		repaired.append(list(coloring))
+		return repair_coloring(adjacency, coloring)
+
+	monkeypatch.setattr(backends, 'process_result', read)
+	monkeypatch.setattr(backends, 'repair_coloring', repair)
+	backend = ScipBackend('lazy')
+	solver, pair_product_group_list, var_count = backend.solve(data)
+	backend.release(solver)
+	assert var_count['objective'] == chromatic_number(data)
+	assert_valid(data, pair_product_group_list, var_count['objective'])
+	# Each round reads a full assignment, the one its repair starts from
+	assert reads
+	for pairs in reads:
+		assert sorted(product for product, _ in pairs) == list(range(data['num_product']))
+	for pairs, coloring in zip(reads, repaired):
+		assert coloring == [group for _, group in sorted(pairs)]
+
+
+@pytest.mark.parametrize('builder', ['vectorized', 'lazy'])
+def test_model_cache_file(builder, tmp_path):
+	data = random_data(0)
+	path = str(tmp_path / 'models.sqlite')
+	# Each ModelCache stands for a new CLI process on the same file
+	for attempt in range(3):
+		backend = ScipBackend(builder, model_cache=ModelCache(path))
+		metrics = SolveMetrics()
+		solver, pair_product_group_list, var_count = backend.solve(data, metrics=metrics)
+		backend.release(solver)
+		assert metrics.model_cache_hit == (attempt > 0)
+		assert_valid(data, pair_product_group_list, chromatic_number(data))
+
+
+def test_read_jobs_invalid_lines():
+	import io
+	from batch import read_jobs
+	jobs = list(read_jobs(io.StringIO('["a", "b"]\n{"products": ["a", \n\n{"id": "x"}\na, c\n')))
+	assert [job['id'] for job in jobs] == [1, 2, 4, 5]
+	assert jobs[0]['products'] == ['a', 'b'] and jobs[3]['products'] == ['a', 'c']
+	assert 'error' in jobs[1] and 'error' in jobs[2]
+
+
+@pytest.mark.parametrize('diagonal_zeros', [0, 2])
+@pytest.mark.parametrize('seed', range(5))
+def test_vectorized_matches_loop(seed, diagonal_zeros):
+	from ortools.linear_solver import pywraplp
+	from model_builder import build_loop_model, build_vectorized_model
+	data = random_data(seed, num_product=6, density=0.6)
+	# A product refusing its own group gets 2 * X[i][k] <= 1 rows, which make the model infeasible
+	for i in random.Random(seed).sample(range(6), diagonal_zeros):
+		data['comp_matrix'][i][i] = 0
+	results = []
+	for build in (build_loop_model, build_vectorized_model):
+		solver = pywraplp.Solver.CreateSolver('SCIP')
+		_, _, var_count = build(solver, data)
+		status = solver.Solve()
+		results.append((var_count, status, solver.Objective().Value() if status == pywraplp.Solver.OPTIMAL else None))
+	assert results[0] == results[1]
+	assert (results[0][1] == pywraplp.Solver.OPTIMAL) == (diagonal_zeros == 0)
+
+
+def name_partition(pair_product_group_list, name_product):
+	"""
+	:return: Groups of a grouping as sets of names, whatever their numbering
+	"""
+	groups = {}
+	for i, group in pair_product_group_list:
+		groups.setdefault(group, set()).add(name_product[i])
+	return sorted(map(sorted, groups.values()))
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+@pytest.mark.parametrize('seed', range(5))
+def test_decomposed_solve(seed, max_workers):
+	data = random_data(seed, num_product=8, density=0.5)
+	for i in range(8):
+		for j in range(8):
+			# Products 0-2 and 3-5 are compatible across, 6 and 7 with everything
+			if (i < 3) != (j < 3) and max(i, j) < 6 or i >= 6 or j >= 6:
+				data['comp_matrix'][i][j] = 1
+	optimum = chromatic_number(data)
+	pair_product_group_list, var_count = solve_decomposed(data, ScipBackend('sparse'), max_workers=max_workers)
+	assert var_count['objective'] == optimum and var_count['status'] == 'OPTIMAL'
+	assert_valid(data, pair_product_group_list, optimum)
+
+
+def test_result_cache_permuted_selection(tmp_path):
+	path = str(tmp_path / 'results.sqlite')
+	names = ['c', 'a', 'b', 'd']
+	pairs = [[0, 0], [2, 0], [1, 1], [3, 1]]
+	ResultCache('matrix', path=path).put(names, pairs, {'objective': 2})
+	# Another catalog on the same file neither sees nor removes the entry
+	assert ResultCache('other', path=path).get(names) is None
+	for cache in (ResultCache('matrix', path=path), ResultCache('matrix', path=path, max_entries=1)):
+		permuted = ['d', 'b', 'c', 'a']
+		cached_pairs, var_count = cache.get(permuted)
+		assert var_count == {'objective': 2}
+		assert name_partition(cached_pairs, permuted) == name_partition(pairs, names)
+	assert ResultCache('matrix', path=path).get(['a', 'b']) is None
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_repair_grouping(seed):
+	data = random_data(seed, num_product=8)
+	first = sub_data_model(data, list(range(6)))
+	previous = dict(zip(first['name_product'], dsatur_coloring(incompatibility_graph(first['comp_matrix']))))
+	kept = [2, 3, 4, 5, 6, 7]
+	second = sub_data_model(data, kept)
+	coloring = repair_grouping(previous, second)
+	assert sorted(set(coloring)) == list(range(len(set(coloring))))
+	assert_valid(second, list(enumerate(coloring)), len(set(coloring)))
+	# Kept products of a previous group are still compatible, so they stay together
+	for a, b in itertools.combinations(range(len(kept)), 2):
+		name_a, name_b = second['name_product'][a], second['name_product'][b]
+		if name_a in previous and name_b in previous and previous[name_a] == previous[name_b]:
+			assert coloring[a] == coloring[b]
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_catalog_binary_round_trip(seed, tmp_path):
+	import numpy as np
+	data = random_data(seed, num_product=9, density=0.6)
+	catalog = CompatibilityCatalog(np.array(data['comp_matrix']), data['name_product'])
+	npy_path = str(tmp_path / 'retention.npy')
+	catalog.to_binary(npy_path)
+	loaded = CompatibilityCatalog.from_binary(npy_path)
+	assert loaded.fingerprint() == catalog.fingerprint()
+	# The digest read from the header matches the one recomputed from the unpacked matrix
+	assert CompatibilityCatalog(loaded.matrix, loaded.product_names).fingerprint() == catalog.fingerprint()
+	selection = ['p7', 'p2', 'p5', 'p0', 'p3']
+	expected = catalog.create_data_model(selection, with_cliques=True)
+	assert loaded.create_data_model(selection, with_cliques=True) == expected
+	# The catalog cliques restricted to the selection give the clique builder an optimal model
+	backend = ScipBackend('clique')
+	solver, pair_product_group_list, var_count = backend.solve(expected)
+	backend.release(solver)
+	assert var_count['objective'] == chromatic_number(expected)
+	assert_valid(expected, pair_product_group_list, var_count['objective'])